@@ -0,0 +1,254 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires);
+"""
+# Ключей в одном запросе с IN: меньше предела числа параметров SQLite
+# (999 в сборках до 3.32).
+KEYS_PER_QUERY = 500
+
+
+def chunks(keys):
+    for start in range(0, len(keys), KEYS_PER_QUERY):
+        yield keys[start:start + KEYS_PER_QUERY]
+
+
+class SQLiteCache(BaseCache):
+    """Общий для всех процессов хоста кеш в файле SQLite в режиме WAL.
+
+    Воркеры gunicorn видят одни и те же записи, clear() и сброс версий
+    действуют сразу во всех процессах. Размер ограничен MAX_ENTRIES и
+    MAX_SIZE (байт): при превышении вытесняются давно не читавшиеся
+    записи. incr() атомарен между процессами благодаря транзакции
+    BEGIN IMMEDIATE.
+
+    OPTIONS: MAX_ENTRIES, CULL_FREQUENCY (как у встроенных бэкендов),
+    MAX_SIZE, CULL_EVERY — как часто (в числе записей) проверять лимиты,
+    TOUCH_INTERVAL — не чаще скольких секунд обновлять время чтения.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._max_size = int(options.get('MAX_SIZE', 256 * 1024 * 1024))
+        self._cull_every = int(options.get('CULL_EVERY', 100))
+        self._touch_interval = float(options.get('TOUCH_INTERVAL', 60))
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+    @property
+    def _db(self):
+        # Соединение своё у каждого потока и процесса: после fork
+        # соединение родителя не используется.
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(
+                self._path, timeout=30, isolation_level=None,
+                check_same_thread=False,
+            )
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript(SCHEMA)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    @contextmanager
+    def _transaction(self, immediate=False):
+        db = self._db
+        db.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _write(self, sql, rows):
+        """Пишет строки одной транзакцией и время от времени проверяет
+        лимиты размера."""
+        with self._transaction() as db:
+            db.executemany(sql, rows)
+        with self._writes_lock:
+            self._writes += 1
+            cull = self._writes % self._cull_every == 0
+        if cull:
+            self._cull()
+
+    def _rows(self, data, timeout):
+        now = time.time()
+        expires = self.get_backend_timeout(timeout)
+        for key, value in data:
+            blob = pickle.dumps(value, self.pickle_protocol)
+            yield key, blob, len(blob), expires, now
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        blob = pickle.dumps(value, self.pickle_protocol)
+        now = time.time()
+        # Одна инструкция: вставка либо замена только просроченной записи.
+        cursor = self._db.execute(
+            'INSERT INTO cache VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value, '
+            'size = excluded.size, expires = excluded.expires, '
+            'accessed = excluded.accessed '
+            'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            (key, blob, len(blob), self.get_backend_timeout(timeout),
+             now, now),
+        )
+        return cursor.rowcount > 0
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        return self._get_many([key]).get(key, default)
+
+    def _get_many(self, keys):
+        now = time.time()
+        db = self._db
+        rows = []
+        for chunk in chunks(keys):
+            placeholders = ', '.join('?' * len(chunk))
+            rows += db.execute(
+                f'SELECT key, value, expires, accessed FROM cache '
+                f'WHERE key IN ({placeholders})',
+                chunk,
+            ).fetchall()
+        found = {}
+        touched = []
+        for key, value, expires, accessed in rows:
+            if expires is not None and expires <= now:
+                continue
+            found[key] = pickle.loads(value)
+            if now - accessed > self._touch_interval:
+                touched.append((now, key))
+        if touched:
+            with self._transaction() as db:
+                db.executemany(
+                    'UPDATE cache SET accessed = ? WHERE key = ?', touched)
+        return found
+
+    def get_many(self, keys, version=None):
+        if not keys:
+            return {}
+        made = {self._key(key, version): key for key in keys}
+        found = self._get_many(list(made))
+        return {made[key]: value for key, value in found.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        self._write(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+            self._rows([(key, value)], timeout),
+        )
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        rows = [
+            (self._key(key, version), value) for key, value in data.items()
+        ]
+        if rows:
+            self._write(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                self._rows(rows, timeout),
+            )
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        cursor = self._db.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        # BEGIN IMMEDIATE берёт блокировку записи до чтения: параллельные
+        # incr из разных процессов выполняются строго по очереди.
+        with self._transaction(immediate=True) as db:
+            row = db.execute(
+                'SELECT value, expires FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or (
+                row[1] is not None and row[1] <= time.time()
+            ):
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            blob = pickle.dumps(value, self.pickle_protocol)
+            db.execute(
+                'UPDATE cache SET value = ?, size = ? WHERE key = ?',
+                (blob, len(blob), key),
+            )
+        return value
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return bool(self._get_many([key]))
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        self._db.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        with self._transaction() as db:
+            for chunk in chunks(keys):
+                placeholders = ', '.join('?' * len(chunk))
+                db.execute(
+                    f'DELETE FROM cache WHERE key IN ({placeholders})', chunk)
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+
+    def _cull(self):
+        """Удаляет просроченные записи, а при превышении лимитов — долю
+        1/CULL_FREQUENCY самых давно читавшихся (LRU)."""
+        with self._transaction(immediate=True) as db:
+            db.execute(
+                'DELETE FROM cache WHERE expires IS NOT NULL '
+                'AND expires <= ?', (time.time(),),
+            )
+            count, size = db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache'
+            ).fetchone()
+            if count <= self._max_entries and size <= self._max_size:
+                return
+            if self._cull_frequency == 0:
+                db.execute('DELETE FROM cache')
+                return
+            excess = max(
+                count - self._max_entries,
+                count * (size - self._max_size) // max(size, 1),
+                0,
+            )
+            db.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                (excess + count // self._cull_frequency,),
+            )
@@ -0,0 +1,193 @@
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+from urllib.parse import quote
+
+from django.test import SimpleTestCase, override_settings
+
+from .cache import SQLiteCache
+
+TEMP_CACHE_DIR = tempfile.mkdtemp()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+IMMUTABLE_NAME = 'posts/ab/' + 'ab' * 32 + '.gif'
+CYRILLIC_NAME = 'posts/котик.gif'
+
+
+def make_cache(name, **options):
+    return SQLiteCache(os.path.join(TEMP_CACHE_DIR, name), {
+        'OPTIONS': options,
+    })
+
+
+def increment(path):
+    cache = SQLiteCache(path, {})
+    for _ in range(50):
+        cache.incr('counter')
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_CACHE_DIR, ignore_errors=True)
+
+    def test_basic_operations(self):
+        """set/get/add/get_many/delete работают как у встроенных
+        бэкендов."""
+        cache = make_cache('basic.sqlite3')
+        cache.set('key', {'value': 1})
+        self.assertEqual(cache.get('key'), {'value': 1})
+        self.assertFalse(cache.add('key', 'other'))
+        self.assertTrue(cache.add('new', 'value'))
+        cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(
+            cache.get_many(['a', 'b', 'missing']), {'a': 1, 'b': 2})
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+        cache.set('expired', 'value', timeout=-1)
+        self.assertIsNone(cache.get('expired'))
+        self.assertTrue(cache.add('expired', 'fresh'))
+        cache.clear()
+        self.assertIsNone(cache.get('key'))
+
+    def test_many_keys_over_sqlite_variable_limit(self):
+        """get_many и delete_many разбивают ключи на порции меньше предела
+        числа параметров SQLite."""
+        cache = make_cache('many.sqlite3')
+        data = {f'key{i}': i for i in range(2500)}
+        cache.set_many(data)
+        self.assertEqual(cache.get_many(list(data)), data)
+        cache.delete_many(list(data))
+        self.assertEqual(cache.get_many(list(data)), {})
+
+    def test_entries_are_shared_between_instances(self):
+        """Два экземпляра с одним файлом видят записи друг друга, как
+        воркеры одного хоста."""
+        first = make_cache('shared.sqlite3')
+        second = make_cache('shared.sqlite3')
+        first.set('key', 'value')
+        self.assertEqual(second.get('key'), 'value')
+        second.clear()
+        self.assertIsNone(first.get('key'))
+
+    def test_incr_is_atomic_across_processes(self):
+        """incr из нескольких процессов не теряет приращений."""
+        path = os.path.join(TEMP_CACHE_DIR, 'incr.sqlite3')
+        cache = SQLiteCache(path, {})
+        cache.set('counter', 0)
+        with self.assertRaises(ValueError):
+            cache.incr('missing')
+        with Pool(4) as pool:
+            pool.map(increment, [path] * 4)
+        self.assertEqual(cache.get('counter'), 200)
+
+    def test_lru_eviction_over_max_entries(self):
+        """При превышении MAX_ENTRIES вытесняются давно не читавшиеся
+        записи."""
+        cache = make_cache(
+            'lru.sqlite3', MAX_ENTRIES=10, CULL_EVERY=1, TOUCH_INTERVAL=0)
+        cache.set('hot', 'value')
+        for i in range(20):
+            cache.get('hot')
+            cache.set(f'cold{i}', i)
+        self.assertEqual(cache.get('hot'), 'value')
+        self.assertIsNone(cache.get('cold0'))
+        self.assertLessEqual(
+            len(cache.get_many([f'cold{i}' for i in range(20)])), 10)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, MEDIA_SENDFILE=None)
+class ServeMediaTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for name in (IMMUTABLE_NAME, 'posts/small.gif', CYRILLIC_NAME):
+            path = os.path.join(TEMP_MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(b'GIF89a')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_file_served_with_validators(self):
+        """Файл отдаётся с типом, ETag и Last-Modified."""
+        response = self.client.get('/media/posts/small.gif')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'GIF89a')
+        self.assertEqual(response['Content-Type'], 'image/gif')
+        self.assertEqual(response['Content-Length'], '6')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+    def test_conditional_requests(self):
+        """Повторный запрос с валидаторами получает 304 без тела."""
+        response = self.client.get('/media/posts/small.gif')
+        for header, value in (
+            ('HTTP_IF_NONE_MATCH', response['ETag']),
+            ('HTTP_IF_MODIFIED_SINCE', response['Last-Modified']),
+        ):
+            with self.subTest(header=header):
+                cached = self.client.get(
+                    '/media/posts/small.gif', **{header: value})
+                self.assertEqual(cached.status_code, 304)
+                self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_cache_lifetime(self):
+        """Неизменяемые по имени файлы кешируются на год, остальные —
+        на MEDIA_MAX_AGE."""
+        response = self.client.get('/media/' + IMMUTABLE_NAME)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        response = self.client.get('/media/posts/small.gif')
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    @override_settings(
+        MEDIA_SENDFILE='x-accel-redirect',
+        MEDIA_ACCEL_PREFIX='/protected-media/',
+    )
+    def test_x_accel_redirect(self):
+        """Для nginx отдаётся только заголовок с внутренним путём."""
+        response = self.client.get('/media/posts/small.gif')
+        self.assertEqual(
+            response['X-Accel-Redirect'], '/protected-media/posts/small.gif')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Content-Type'], 'image/gif')
+
+    @override_settings(
+        MEDIA_SENDFILE='x-accel-redirect',
+        MEDIA_ACCEL_PREFIX='/protected-media/',
+    )
+    def test_non_ascii_names_percent_encoded(self):
+        """Имена не в ASCII передаются прокси в процентной кодировке."""
+        response = self.client.get('/media/' + CYRILLIC_NAME)
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            '/protected-media/posts/%D0%BA%D0%BE%D1%82%D0%B8%D0%BA.gif',
+        )
+        with self.settings(MEDIA_SENDFILE='x-sendfile'):
+            response = self.client.get('/media/' + CYRILLIC_NAME)
+        self.assertEqual(
+            response['X-Sendfile'],
+            quote(os.path.join(TEMP_MEDIA_ROOT, CYRILLIC_NAME)),
+        )
+
+    @override_settings(MEDIA_SENDFILE='x-sendfile')
+    def test_x_sendfile(self):
+        """Для X-Sendfile передаётся полный путь к файлу."""
+        response = self.client.get('/media/posts/small.gif')
+        self.assertEqual(
+            response['X-Sendfile'],
+            os.path.join(TEMP_MEDIA_ROOT, 'posts', 'small.gif'),
+        )
+        self.assertEqual(response.content, b'')
+
+    def test_missing_and_outside_files(self):
+        """Отсутствующие файлы, каталоги и пути вне MEDIA_ROOT — 404."""
+        for path in ('posts/missing.gif', 'posts/', '../etc/passwd'):
+            with self.subTest(path=path):
+                response = self.client.get('/media/' + path)
+                self.assertEqual(response.status_code, 404)
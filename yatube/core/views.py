@@ -1,4 +1,16 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
 
 
 def page_not_found(request, exception):
@@ -17,3 +29,55 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+@require_safe
+def serve_media(request, path):
+    """Отдаёт файл из MEDIA_ROOT с ETag, Last-Modified и Cache-Control.
+
+    Сами байты отдаёт фронтовой прокси: при MEDIA_SENDFILE
+    'x-accel-redirect' (nginx) ответ содержит только заголовок
+    X-Accel-Redirect с путём под MEDIA_ACCEL_PREFIX, при 'x-sendfile'
+    (Apache, lighttpd) — X-Sendfile с полным путём. Без MEDIA_SENDFILE
+    файл отдаётся самим Django, как при разработке.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    etag = f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        mode = settings.MEDIA_SENDFILE
+        if mode == 'x-accel-redirect':
+            response = HttpResponse()
+            # Путь кодируется процентами: иначе Django отдаст имя не в
+            # ASCII (старые загрузки) MIME-словом, и прокси файла не найдёт.
+            response['X-Accel-Redirect'] = quote(
+                settings.MEDIA_ACCEL_PREFIX + path)
+        elif mode == 'x-sendfile':
+            response = HttpResponse()
+            response['X-Sendfile'] = quote(full_path)
+        else:
+            response = FileResponse(open(full_path, 'rb'))
+        content_type, encoding = mimetypes.guess_type(full_path)
+        response['Content-Type'] = content_type or 'application/octet-stream'
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Content-Length'] = stat.st_size
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if any(
+        re.match(pattern, path)
+        for pattern in settings.MEDIA_IMMUTABLE_PATTERNS
+    ):
+        response['Cache-Control'] = (
+            f'public, max-age={settings.MEDIA_IMMUTABLE_MAX_AGE}, immutable')
+    else:
+        response['Cache-Control'] = (
+            f'public, max-age={settings.MEDIA_MAX_AGE}')
+    return response
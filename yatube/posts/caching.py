@@ -0,0 +1,121 @@
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def feed_version_key(*feed):
+    return 'feed_version:' + ':'.join(str(part) for part in feed)
+
+
+def _initial_version():
+    # Отсчёт поколений с текущего времени, а не с нуля: если счётчик
+    # вытеснен из кеша, новые ключи не совпадут со старыми фрагментами.
+    return int(time.time() * 1000)
+
+
+def feed_version(*feed):
+    """Текущее поколение ленты, например ('index',), ('group', 1) или
+    ('author', 1). Входит в ключи кеша фрагментов."""
+    key = feed_version_key(*feed)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_feed(*feed):
+    """Сдвигает поколение ленты: закешированные фрагменты с прежним
+    поколением больше не читаются и вытесняются по таймауту."""
+    key = feed_version_key(*feed)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), None)
+
+
+def bump_post_feeds(post, group_ids=()):
+    """Сдвигает поколения всех лент, где показывается пост."""
+    bump_feed('index')
+    bump_feed('author', post.author_id)
+    for group_id in {post.group_id, *group_ids} - {None}:
+        bump_feed('group', group_id)
+
+
+def page_cache_keys(path, params):
+    """Ключи закешированного ответа для анонимного пользователя: текущий
+    (с поколением пути) и ключ последнего ответа для отдачи во время
+    пересчёта."""
+    query = '&'.join(f'{name}={value}' for name, value in sorted(params))
+    return (
+        f'page:{feed_version("page", path)}:{path}?{query}',
+        f'page:stale:{path}?{query}',
+    )
+
+
+def purge_pages(*paths):
+    """Сбрасывает закешированные ответы по указанным путям, с любыми
+    параметрами страницы."""
+    for path in paths:
+        bump_feed('page', path)
+
+
+def _should_refresh_early(soft_expiry, delta):
+    """Вероятностное раннее истечение (XFetch): чем ближе срок и чем
+    дольше пересчёт, тем вероятнее обновить запись заранее."""
+    beta = settings.CACHE_EARLY_EXPIRY_BETA
+    return time.time() - delta * beta * math.log(random.random()) >= (
+        soft_expiry)
+
+
+def get_or_rebuild(key, rebuild, timeout, stale_key=None,
+                   should_store=None):
+    """Значение из кеша или результат rebuild(), пересчитываемый только
+    одним процессом.
+
+    Пересчёт берёт блокировку через cache.add. Остальные процессы тем
+    временем отдают устаревшее значение: текущую запись или последнюю
+    запись по stale_key (ключ без поколения). Если отдать нечего, они
+    ждут результата не дольше CACHE_LOCK_WAIT секунд.
+    """
+    envelope = cache.get(key)
+    if envelope is not None:
+        value, soft_expiry, delta = envelope
+        if not _should_refresh_early(soft_expiry, delta):
+            return value
+    lock_key = f'lock:{key}'
+    if not cache.add(lock_key, True, settings.CACHE_LOCK_TIMEOUT):
+        if envelope is None and stale_key is not None:
+            envelope = cache.get(stale_key)
+        if envelope is None:
+            envelope = _wait_for(key)
+        if envelope is not None:
+            return envelope[0]
+        return rebuild()
+    try:
+        started = time.time()
+        value = rebuild()
+        if should_store is None or should_store(value):
+            envelope = (value, time.time() + timeout, time.time() - started)
+            cache.set(key, envelope, timeout)
+            if stale_key is not None:
+                cache.set(
+                    stale_key, envelope,
+                    timeout + settings.CACHE_STALE_TIMEOUT,
+                )
+        return value
+    finally:
+        cache.delete(lock_key)
+
+
+def _wait_for(key):
+    deadline = time.time() + settings.CACHE_LOCK_WAIT
+    while time.time() < deadline:
+        time.sleep(0.05)
+        envelope = cache.get(key)
+        if envelope is not None:
+            return envelope
+    return None
@@ -0,0 +1,65 @@
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Follow, Post, UserCounter
+
+
+def count_by(queryset, field, user_ids):
+    return dict(
+        queryset.filter(**{f'{field}__in': user_ids}).order_by().values_list(
+            field).annotate(Count('pk'))
+    )
+
+
+def counted(user_ids):
+    """Несохранённые счётчики пользователей, посчитанные по таблицам."""
+    posts = count_by(Post.objects, 'author', user_ids)
+    followers = count_by(Follow.objects, 'author', user_ids)
+    following = count_by(Follow.objects, 'user', user_ids)
+    return [
+        UserCounter(
+            user_id=user_id,
+            posts_count=posts.get(user_id, 0),
+            followers_count=followers.get(user_id, 0),
+            following_count=following.get(user_id, 0),
+        )
+        for user_id in user_ids
+    ]
+
+
+@transaction.atomic
+def rebuild(user_ids):
+    """Пересчитывает счётчики пользователей с нуля."""
+    UserCounter.objects.filter(user_id__in=user_ids).delete()
+    UserCounter.objects.bulk_create(counted(user_ids))
+
+
+def bump(user_id, **deltas):
+    """Атомарно меняет счётчики пользователя на заданные величины.
+
+    Уменьшение не опускает счётчик ниже нуля и не создаёт строку: при
+    удалении пользователя каскад стирает её раньше его постов и подписок.
+    Недостающая строка (пользователь заведён в обход сигналов)
+    создаётся при увеличении — сразу с подсчитанными значениями.
+    """
+    counters = UserCounter.objects.filter(user_id=user_id)
+    for field, delta in deltas.items():
+        if delta < 0:
+            counters = counters.filter(**{f'{field}__gte': -delta})
+    updated = counters.update(
+        **{field: F(field) + delta for field, delta in deltas.items()})
+    if not updated and all(delta > 0 for delta in deltas.values()):
+        counter, = counted([user_id])
+        UserCounter.objects.bulk_create([counter], ignore_conflicts=True)
+
+
+def user_counter(user):
+    """Счётчики пользователя для шаблонов; строка, которой нет,
+    создаётся с подсчитанными значениями."""
+    try:
+        return user.counter
+    except UserCounter.DoesNotExist:
+        counter, = counted([user.pk])
+        UserCounter.objects.bulk_create([counter], ignore_conflicts=True)
+        user.counter = counter
+        return counter
@@ -0,0 +1,327 @@
+import heapq
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+
+from .models import Comment, Follow, Post, TimelineEntry, UserCounter
+from .utils import CursorPaginator, encode_key, seek
+
+# Полный текст поста нужен только его странице; карточки лент выводят
+# excerpt_html.
+FEED_DEFERRED_FIELDS = ('text', 'text_html')
+
+
+def deferred_text(related=''):
+    """Поля полного текста для defer(); related — путь к посту от
+    выбираемой модели."""
+    return [related + field for field in FEED_DEFERRED_FIELDS]
+
+
+def celebrities_key():
+    return f'feed_celebrities:{settings.FEED_CELEBRITY_FOLLOWERS}'
+
+
+def celebrity_ids():
+    """Авторы, у которых подписчиков не меньше FEED_CELEBRITY_FOLLOWERS.
+
+    Их посты не раскладываются по лентам подписчиков, а подмешиваются
+    при чтении. Список кешируется на FEED_CELEBRITY_CACHE_TIMEOUT секунд.
+    """
+    threshold = settings.FEED_CELEBRITY_FOLLOWERS
+    key = celebrities_key()
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(
+            UserCounter.objects.filter(
+                followers_count__gte=threshold).values_list('pk', flat=True)
+        )
+        cache.set(key, ids, settings.FEED_CELEBRITY_CACHE_TIMEOUT)
+    return ids
+
+
+def fan_out(post):
+    """Кладёт новый пост в ленты всех подписчиков автора, если автор не
+    из числа популярных."""
+    if post.author_id in celebrity_ids():
+        return
+    # order_by() снимает сортировку Meta.ordering: порядок подписчиков
+    # не важен, а сортировка потребовала бы временного B-дерева.
+    followers = Follow.objects.filter(
+        author_id=post.author_id).order_by().values_list('user_id', flat=True)
+    entries = (
+        TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+        for user_id in followers.iterator()
+    )
+    TimelineEntry.objects.bulk_create(
+        entries,
+        batch_size=settings.FOLLOW_TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user, author):
+    """Добавляет в ленту пользователя последние посты нового автора и
+    обрезает ленту до FOLLOW_TIMELINE_LENGTH записей."""
+    if author.pk in celebrity_ids():
+        return
+    posts = author.posts.values_list('pk', 'pub_date')
+    fill_timelines(
+        [user.pk], list(posts[:settings.FOLLOW_TIMELINE_LENGTH]))
+
+
+def follower_removed(author_id):
+    """Если после отписки автор опустился ниже FEED_CELEBRITY_FOLLOWERS,
+    его посты снова раскладываются по лентам: оставшимся подписчикам
+    добавляются его последние посты, иначе посты периода популярности
+    пропали бы из их лент."""
+    if not UserCounter.objects.filter(
+        user_id=author_id,
+        followers_count=settings.FEED_CELEBRITY_FOLLOWERS - 1,
+    ).exists():
+        return
+    cache.delete(celebrities_key())
+    posts = list(Post.objects.filter(author_id=author_id).values_list(
+        'pk', 'pub_date')[:settings.FOLLOW_TIMELINE_LENGTH])
+    if not posts:
+        return
+    followers = Follow.objects.filter(
+        author_id=author_id).order_by().values_list('user_id', flat=True)
+    chunk = []
+    for user_id in followers.iterator():
+        chunk.append(user_id)
+        if len(chunk) == settings.FOLLOW_TIMELINE_BATCH_SIZE:
+            fill_timelines(chunk, posts)
+            chunk = []
+    if chunk:
+        fill_timelines(chunk, posts)
+
+
+def fill_timelines(user_ids, posts):
+    """Добавляет посты (id, pub_date) в ленты пользователей user_ids и
+    обрезает эти ленты."""
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+            for user_id in user_ids
+            for post_id, pub_date in posts
+        ),
+        batch_size=settings.FOLLOW_TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim_timelines(user_ids)
+
+
+def trim_timelines(user_ids):
+    """Оставляет в лентах пользователей user_ids по FOLLOW_TIMELINE_LENGTH
+    последних записей; возвращает число удалённых.
+
+    fan_out только добавляет записи, так что ленты обрезаются отдельно —
+    командой trim_timelines по расписанию.
+    """
+    table = TimelineEntry._meta.db_table
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN ('
+            f'SELECT id FROM (SELECT id, ROW_NUMBER() OVER ('
+            f'PARTITION BY user_id ORDER BY pub_date DESC, id DESC'
+            f') AS position FROM {table} WHERE user_id IN ({placeholders})'
+            f') WHERE position > %s)',
+            [*user_ids, settings.FOLLOW_TIMELINE_LENGTH],
+        )
+        return cursor.rowcount
+
+
+def prune(user, author):
+    """Убирает из ленты пользователя посты автора, от которого он
+    отписался."""
+    TimelineEntry.objects.filter(user=user, post__author=author).delete()
+
+
+def timeline_entries(user):
+    """Записи материализованной ленты пользователя, не старше
+    FOLLOW_TIMELINE_LENGTH-й записи."""
+    length = settings.FOLLOW_TIMELINE_LENGTH
+    entries = user.timeline.all()
+    cutoff = list(entries.order_by('-pub_date').values_list(
+        'pub_date', flat=True)[length - 1:length])
+    if cutoff:
+        entries = entries.filter(pub_date__gte=cutoff[0])
+    return entries
+
+
+def merge(sources, newer=False):
+    """k-way слияние отсортированных списков постов по (pub_date, id) с
+    удалением дублей: пост популярного автора мог попасть в ленту ещё до
+    того, как автор перешёл порог."""
+    seen = set()
+    merged = heapq.merge(
+        *sources, key=lambda post: (post.pub_date, post.pk),
+        reverse=not newer,
+    )
+    for post in merged:
+        if post.pk not in seen:
+            seen.add(post.pk)
+            yield post
+
+
+class HybridFeed:
+    """Лента подписок: посты обычных авторов берутся из материализованной
+    ленты, посты популярных авторов — напрямую из их постов при чтении.
+
+    Поддерживает count() и срезы для Paginator — не глубже
+    FOLLOW_TIMELINE_LENGTH постов — и seek() для CursorPaginator.
+    """
+    ordered = True
+
+    def __init__(self, user):
+        entries = timeline_entries(user)
+        self.timeline = entries.select_related(
+            'post__author', 'post__group').defer(*deferred_text('post__'))
+        followed_celebrities = list(Follow.objects.filter(
+            user=user, author__in=celebrity_ids()
+        ).values_list('author', flat=True))
+        self.pulled = [
+            Post.objects.filter(
+                author_id=author_id).select_related(
+                'author', 'group').defer(*deferred_text())
+            for author_id in followed_celebrities
+        ]
+        # Для числа постов — то же объединение одним запросом: пост
+        # популярного автора мог попасть и в материализованную ленту.
+        self.posts = Post.objects.filter(
+            Q(pk__in=entries.values('post_id'))
+            | Q(author_id__in=followed_celebrities)
+        )
+
+    def _sources(self, fetch):
+        # Ленту читаем по её собственному ключу (pub_date, post_id), чтобы
+        # и фильтр, и сортировка шли по индексу записей ленты.
+        yield [
+            entry.post
+            for entry in fetch(self.timeline, ('pub_date', 'post_id'))
+        ]
+        for posts in self.pulled:
+            yield fetch(posts, ('pub_date', 'pk'))
+
+    def count(self):
+        # Постраничная навигация не глубже материализованной ленты: каждый
+        # источник читается до конца запрошенной страницы, а COUNT
+        # останавливается на FOLLOW_TIMELINE_LENGTH постах.
+        return self.posts.order_by().values('pk')[
+            :settings.FOLLOW_TIMELINE_LENGTH].count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        stop = min(index.stop, settings.FOLLOW_TIMELINE_LENGTH)
+
+        def fetch(queryset, fields):
+            return seek(queryset, None, False, stop, fields)
+
+        return list(merge(self._sources(fetch)))[index.start:stop]
+
+    def seek(self, key, newer, limit):
+        def fetch(queryset, fields):
+            return seek(queryset, key, newer, limit, fields)
+
+        merged = merge(self._sources(fetch), newer=newer)
+        return list(merged)[:limit]
+
+
+class TagFeed:
+    """Лента тега. Посты выбираются проходом по индексу (tag, pub_date,
+    post) связей PostTag, а число постов берётся из счётчика тега.
+
+    Поддерживает count() и срезы для Paginator и seek() для
+    CursorPaginator.
+    """
+    ordered = True
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.entries = tag.post_tags.select_related(
+            'post__author', 'post__group').defer(
+            *deferred_text('post__')).order_by('-pub_date', '-post_id')
+
+    def count(self):
+        return self.tag.posts_count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        return [entry.post for entry in self.entries[index]]
+
+    def seek(self, key, newer, limit):
+        entries = seek(
+            self.entries, key, newer, limit, ('pub_date', 'post_id'))
+        return [entry.post for entry in entries]
+
+
+def encode_mention_cursor(post):
+    """Токен позиции в ленте упоминаний: (время последнего упоминания,
+    id поста); читается обычным decode_cursor."""
+    return encode_key(post.mentioned.isoformat(), post.pk)
+
+
+class MentionPaginator(CursorPaginator):
+    encode_cursor = staticmethod(encode_mention_cursor)
+
+
+class MentionFeed:
+    """Лента упоминаний пользователя: по одному посту на все упоминания
+    в нём и в комментариях к нему, от последнего упоминания. Посты
+    выбираются проходом по индексу (user, last_mentioned, post) строк
+    MentionedPost. В mention_comments у поста — комментарии с
+    упоминанием, в mentioned — время последнего упоминания.
+
+    Поддерживает count() и срезы для Paginator и seek() для
+    CursorPaginator.
+    """
+    ordered = True
+    cursor_paginator = MentionPaginator
+
+    def __init__(self, user):
+        self.user = user
+        self.entries = user.mentioned_posts.select_related(
+            'post__author', 'post__group').defer(
+            *deferred_text('post__')).order_by('-last_mentioned', '-post_id')
+
+    def count(self):
+        return self.user.mentioned_posts.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        return self.load(list(self.entries[index]))
+
+    def seek(self, key, newer, limit):
+        return self.load(seek(
+            self.entries, key, newer, limit, ('last_mentioned', 'post_id')))
+
+    def load(self, entries):
+        """Посты записей и одним запросом — комментарии к ним с
+        упоминанием пользователя."""
+        posts = {}
+        for entry in entries:
+            post = entry.post
+            post.mentioned = entry.last_mentioned
+            post.mention_comments = []
+            posts[post.pk] = post
+        comments = Comment.objects.filter(
+            mentions__user=self.user, post_id__in=list(posts),
+        ).select_related('author').order_by()
+        for comment in sorted(comments, key=lambda c: (c.created, c.pk)):
+            posts[comment.post_id].mention_comments.append(comment)
+        return list(posts.values())
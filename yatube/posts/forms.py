@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from .images import ingest, validate_upload
 from .models import Post, Comment
 
 
@@ -8,6 +10,14 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if not isinstance(image, UploadedFile):
+            return image
+        validate_upload(image)
+        image, self.instance._image_variants = ingest(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
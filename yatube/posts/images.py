@@ -0,0 +1,186 @@
+import hashlib
+import os
+import warnings
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps, features
+
+# Форматы, которые сохраняются как есть; остальные перекодируются в JPEG.
+KEPT_FORMATS = ('JPEG', 'PNG', 'WEBP')
+# Многие JPEG с телефонов (с блоком MPF) Pillow открывает как MPO; такие
+# снимки проверяются и хранятся как JPEG из первого кадра.
+FORMAT_ALIASES = {'MPO': 'JPEG'}
+WEBP_SUFFIX = '.webp'
+
+
+def validate_upload(upload):
+    """Отклоняет загрузку до того, как картинка будет декодирована.
+
+    Проверяются объём файла, формат и размеры по заголовку: слишком
+    большая картинка не развернётся в память воркера при уменьшении.
+    """
+    limit = settings.POST_IMAGE_MAX_UPLOAD_SIZE
+    if upload.size > limit:
+        raise ValidationError(
+            f'Файл больше {filesizeformat(limit)}.',
+            code='file_too_large',
+        )
+    upload.seek(0)
+    try:
+        with warnings.catch_warnings():
+            # Размеры проверяются ниже по своим лимитам.
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(upload) as image:
+                image_format = FORMAT_ALIASES.get(image.format, image.format)
+                width, height = image.size
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError(
+            'Не удалось прочитать картинку.', code='invalid_image')
+    finally:
+        upload.seek(0)
+    if image_format not in settings.POST_IMAGE_FORMATS:
+        raise ValidationError(
+            f'Формат {image_format} не поддерживается.',
+            code='invalid_format',
+        )
+    if max(width, height) > settings.POST_IMAGE_MAX_DIMENSION:
+        raise ValidationError(
+            f'Сторона картинки больше '
+            f'{settings.POST_IMAGE_MAX_DIMENSION} пикселей.',
+            code='too_large',
+        )
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'В картинке слишком много пикселей.', code='too_many_pixels')
+
+
+def probe(file):
+    """Ширина, высота, формат, размер в байтах и SHA-256 картинки.
+
+    Pillow читает только заголовок: картинка не декодируется. Для хеша
+    файл прочитывается по частям.
+    """
+    was_closed = file.closed
+    file.open('rb')
+    try:
+        file.seek(0)
+        with Image.open(file) as image:
+            width, height = image.size
+            image_format = image.format
+        digest = hashlib.sha256()
+        for chunk in file.chunks():
+            digest.update(chunk)
+    finally:
+        if was_closed:
+            file.close()
+        else:
+            file.seek(0)
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_size': file.size,
+        'image_format': image_format,
+        'image_hash': digest.hexdigest(),
+    }
+
+
+EMPTY_METADATA = {
+    'image_width': None,
+    'image_height': None,
+    'image_size': None,
+    'image_format': '',
+    'image_hash': '',
+}
+
+
+def image_metadata(file):
+    """Сведения о картинке для полей Post; пустые, если картинки нет или
+    её не удалось прочитать."""
+    if not file:
+        return dict(EMPTY_METADATA)
+    try:
+        return probe(file)
+    except (OSError, SuspiciousFileOperation):
+        return dict(EMPTY_METADATA)
+
+
+def webp_name(name):
+    """Имя WebP-варианта картинки, лежащего рядом с оригиналом."""
+    return name + WEBP_SUFFIX
+
+
+def _encode(image, image_format, **options):
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def ingest(upload):
+    """Готовит загруженную картинку поста к хранению.
+
+    Уменьшает её до POST_IMAGE_MAX_SIZE, поворачивает по EXIF и
+    перекодирует без метаданных. JPEG декодируется сразу в уменьшенном
+    масштабе (draft/reduce), так что большие фотографии не разворачиваются
+    в память целиком. GIF и анимированные картинки не трогаются.
+
+    Возвращает новый файл и словарь вариантов {суффикс имени: байты}:
+    WebP-вариант, если Pillow собран с libwebp. Картинку, которая не
+    декодируется (например, обрезанный JPEG с целым заголовком),
+    отклоняет ValidationError.
+    """
+    try:
+        return _ingest(upload)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError(
+            'Не удалось прочитать картинку.', code='invalid_image')
+    finally:
+        upload.seek(0)
+
+
+def _ingest(upload):
+    upload.seek(0)
+    image = Image.open(upload)
+    image_format = FORMAT_ALIASES.get(image.format, image.format)
+    if image.format == 'GIF' or (
+        image_format == image.format and getattr(image, 'is_animated', False)
+    ):
+        upload.seek(0)
+        return upload, {}
+    name = upload.name
+    if image_format not in KEPT_FORMATS:
+        image_format = 'JPEG'
+        name = os.path.splitext(name)[0] + '.jpg'
+    # Цветовой профиль сохраняется, остальные метаданные отбрасываются.
+    profile = {}
+    if image.info.get('icc_profile'):
+        profile['icc_profile'] = image.info['icc_profile']
+    image.thumbnail(
+        settings.POST_IMAGE_MAX_SIZE, Image.LANCZOS, reducing_gap=3.0)
+    image = ImageOps.exif_transpose(image)
+    if image_format == 'JPEG':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        content = _encode(
+            image, 'JPEG', quality=settings.POST_IMAGE_QUALITY,
+            optimize=True, progressive=True, **profile,
+        )
+    elif image_format == 'PNG':
+        content = _encode(image, 'PNG', optimize=True)
+    else:
+        content = _encode(
+            image, 'WEBP', quality=settings.POST_IMAGE_WEBP_QUALITY,
+            **profile,
+        )
+    variants = {}
+    if image_format != 'WEBP' and features.check('webp'):
+        variants[WEBP_SUFFIX] = _encode(
+            image, 'WEBP', quality=settings.POST_IMAGE_WEBP_QUALITY,
+            **profile,
+        )
+    ingested = SimpleUploadedFile(
+        name, content, Image.MIME.get(image_format))
+    return ingested, variants
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.images import EMPTY_METADATA, image_metadata
+from posts.models import Post
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет размеры, формат, объём и хеш картинок постов, у которых '
+        'эти сведения ещё не записаны. При обновлении это делает миграция '
+        '0020; команда нужна, если файлы картинок восстановили позже. '
+        'Работает порциями; прерванный запуск можно повторить — '
+        'обработанные посты пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Сколько постов обрабатывать за одну транзакцию.',
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').filter(
+            image_hash='').order_by('pk').only('pk', 'image')
+        last_pk = 0
+        filled = missing = 0
+        while True:
+            chunk = list(posts.filter(pk__gt=last_pk)[:options['chunk_size']])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            for post in chunk:
+                for field, value in image_metadata(post.image).items():
+                    setattr(post, field, value)
+                if post.image_hash:
+                    filled += 1
+                else:
+                    missing += 1
+            self.save(chunk)
+        self.stdout.write(
+            f'Заполнены сведения о {filled} картинках, '
+            f'не прочитано файлов: {missing}'
+        )
+
+    @transaction.atomic
+    def save(self, posts):
+        Post.objects.bulk_update(posts, list(EMPTY_METADATA))
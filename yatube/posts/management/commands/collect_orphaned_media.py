@@ -0,0 +1,216 @@
+import itertools
+import os
+import shutil
+import time
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.helpers import deserialize
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix, del_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from posts.images import WEBP_SUFFIX
+from posts.models import Post
+from posts.thumbnails import delete_thumbnails
+
+CHUNK_SIZE = 1000
+
+
+def scan(root, directory, older_than):
+    """Имена файлов каталога directory (относительно root) со временем
+    изменения раньше older_than. Каталоги обходятся os.scandir без
+    составления полного списка, так что память не растёт с их
+    размером."""
+    try:
+        entries = os.scandir(os.path.join(root, directory))
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            name = f'{directory}/{entry.name}'
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan(root, name, older_than)
+            elif (
+                entry.is_file(follow_symlinks=False)
+                and entry.stat().st_mtime < older_than
+            ):
+                yield name
+
+
+def chunks(names, size):
+    names = iter(names)
+    while True:
+        chunk = list(itertools.islice(names, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def original_name(name):
+    """Имя картинки, к которой относится файл: WebP-вариант лежит рядом
+    с оригиналом под именем «<оригинал>.webp»."""
+    stem, extension = os.path.splitext(name)
+    if extension == WEBP_SUFFIX and os.path.splitext(stem)[1]:
+        return stem
+    return name
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из MEDIA_ROOT картинки постов, WebP-варианты и миниатюры, '
+        'на которые не ссылается ни один пост. Каталоги обходятся потоком '
+        'и сверяются с базой порциями, так что память не зависит от числа '
+        'файлов. Файлы моложе POST_IMAGE_RELEASE_GRACE не трогаются. '
+        'Команду можно запускать по расписанию (cron, systemd-таймер).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Сколько файлов сверять с базой одним запросом.',
+        )
+        parser.add_argument(
+            '--quarantine', metavar='DIR',
+            help='Переносить найденные файлы в каталог DIR, а не удалять.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только вывести найденные файлы.',
+        )
+
+    def handle(self, *args, **options):
+        self.quarantine = options['quarantine']
+        self.dry_run = options['dry_run']
+        self.storage = Post._meta.get_field('image').storage
+        older_than = time.time() - settings.POST_IMAGE_RELEASE_GRACE
+        root = settings.MEDIA_ROOT
+        directory = Post._meta.get_field('image').upload_to.strip('/')
+        images = thumbnails = 0
+        for chunk in chunks(
+            scan(root, directory, older_than), options['chunk_size']
+        ):
+            for name in self.orphaned_images(chunk):
+                images += self.remove(
+                    root, name, with_thumbnails=original_name(name) == name)
+        # Миниатюры удалённых выше картинок уже стёрты вместе с записями.
+        # Дальше — миниатюры картинок, на которые не ссылается ни один
+        # пост, хотя записи sorl о них остались, и затем файлы, о которых
+        # хранилище sorl ничего не знает.
+        thumbnails += self.collect_stale_thumbnails(options['chunk_size'])
+        directory = sorl_settings.THUMBNAIL_PREFIX.strip('/')
+        for chunk in chunks(
+            scan(root, directory, older_than), options['chunk_size']
+        ):
+            for name in self.orphaned_thumbnails(chunk):
+                thumbnails += self.remove(root, name)
+        action = 'Найдено' if self.dry_run else (
+            'Перенесено' if self.quarantine else 'Удалено')
+        self.stdout.write(
+            f'{action} картинок: {images}, миниатюр: {thumbnails}')
+
+    def orphaned_images(self, names):
+        referenced = set(Post.objects.filter(
+            image__in={original_name(name) for name in names}
+        ).values_list('image', flat=True))
+        return [
+            name for name in names
+            if original_name(name) not in referenced
+        ]
+
+    def collect_stale_thumbnails(self, chunk_size):
+        """Удаляет миниатюры и записи sorl исходников, которых нет среди
+        Post.image; возвращает число миниатюр. Списки миниатюр читаются
+        из хранилища sorl порциями по ключу."""
+        prefix = add_prefix('', 'thumbnails')
+        lists = KVStoreModel.objects.filter(
+            key__startswith=prefix).order_by('key')
+        removed = 0
+        last_key = ''
+        while True:
+            chunk = dict(lists.filter(key__gt=last_key).values_list(
+                'key', 'value')[:chunk_size])
+            if not chunk:
+                return removed
+            last_key = max(chunk)
+            thumbnails = {
+                del_prefix(key): deserialize(value) or []
+                for key, value in chunk.items()
+            }
+            for key, names in self.stale_sources(thumbnails).items():
+                removed += self.remove_thumbnails(key, names)
+
+    def stale_sources(self, thumbnails):
+        """Из {ключ исходника: ключи миниатюр} — исходники, на которые не
+        ссылается ни один пост, с именами файлов их миниатюр."""
+        sources = self.image_names(thumbnails)
+        live = set(Post.objects.filter(
+            image__in=set(sources.values())).values_list('image', flat=True))
+        stale = {}
+        for key, keys in thumbnails.items():
+            name = sources.get(key)
+            # Свежую картинку мог ещё не записать её пост.
+            if name in live or name and self.storage.recently_saved(name):
+                continue
+            stale[key] = keys
+        names = self.image_names(
+            [key for keys in stale.values() for key in keys])
+        return {
+            key: [names[key] for key in keys if key in names]
+            for key, keys in stale.items()
+        }
+
+    def image_names(self, keys):
+        values = KVStoreModel.objects.filter(
+            key__in=[add_prefix(key) for key in keys]
+        ).values_list('key', 'value')
+        return {
+            del_prefix(key): deserialize_image_file(value).name
+            for key, value in values
+        }
+
+    def remove_thumbnails(self, key, names):
+        """Удаляет файлы миниатюр исходника key и записи sorl о них и о
+        нём самом; 1 за каждую миниатюру."""
+        if self.dry_run:
+            for name in names:
+                self.stdout.write(name)
+        else:
+            default.kvstore.delete(SimpleNamespace(key=key))
+        return len(names)
+
+    def orphaned_thumbnails(self, names):
+        keys = {
+            add_prefix(ImageFile(name, default.storage).key): name
+            for name in names
+        }
+        known = set(KVStoreModel.objects.filter(
+            key__in=keys).values_list('key', flat=True))
+        return [name for key, name in keys.items() if key not in known]
+
+    def remove(self, root, name, with_thumbnails=False):
+        """Удаляет или переносит файл; 1, если он был обработан.
+        Миниатюры картинки (with_thumbnails) всегда удаляются: их можно
+        создать заново."""
+        if self.dry_run:
+            self.stdout.write(name)
+            return 1
+        # Ту же картинку могли загрузить заново после сверки с базой.
+        if self.storage.recently_saved(name):
+            return 0
+        if with_thumbnails:
+            delete_thumbnails(name, self.storage)
+        path = os.path.join(root, name)
+        try:
+            if self.quarantine:
+                target = os.path.join(self.quarantine, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            return 0
+        return 1
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts.resize import cull
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет давно не читавшиеся варианты картинок (posts.resize), '
+        'пока их кеш больше RESIZE_CACHE_MAX_SIZE байт. Команду стоит '
+        'запускать по расписанию (cron, systemd-таймер): запросы вариантов '
+        'кеш не чистят.'
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Удалено вариантов картинок: {cull()}')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.tags import prune_activity
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет почасовые счётчики тегов старше TAG_TRENDING_HOURS. '
+        'Команду стоит запускать по расписанию (cron, systemd-таймер): '
+        'популярные теги читают только счётчики внутри окна.'
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Удалено счётчиков тегов: {prune_activity()}')
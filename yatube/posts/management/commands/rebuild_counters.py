@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import rebuild
+from posts.models import User
+
+CHUNK_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов и подписок всех пользователей.'
+
+    def handle(self, *args, **options):
+        user_ids = User.objects.order_by('pk').values_list('pk', flat=True)
+        chunk = []
+        total = 0
+        for user_id in user_ids.iterator():
+            chunk.append(user_id)
+            if len(chunk) == CHUNK_SIZE:
+                rebuild(chunk)
+                total += len(chunk)
+                chunk = []
+        if chunk:
+            rebuild(chunk)
+            total += len(chunk)
+        self.stdout.write(f'Пересчитаны счётчики {total} пользователей')
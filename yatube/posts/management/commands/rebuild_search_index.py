@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = (
+        'Перестраивает полнотекстовые индексы постов и комментариев, '
+        'например после правки текстов в обход моделей.'
+    )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        for model in search.INDEXES:
+            search.rebuild(model)
+            self.stdout.write(
+                f'Перестроен индекс {model._meta.verbose_name_plural}')
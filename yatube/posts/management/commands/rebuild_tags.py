@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import Post, PostTag, Tag
+from posts.tags import sync_tags
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Разбирает хештеги всех постов и пересчитывает связи и счётчики '
+        'тегов. Популярные теги при этом не меняются.'
+    )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.order_by('pk').only('pk', 'text', 'pub_date')
+        last_pk = 0
+        total = 0
+        while True:
+            chunk = list(posts.filter(pk__gt=last_pk)[:CHUNK_SIZE])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            self.sync(chunk)
+            total += len(chunk)
+        counts = PostTag.objects.filter(tag=OuterRef('pk')).order_by()
+        counts = counts.values('tag').annotate(
+            total=Count('pk')).values('total')
+        Tag.objects.update(posts_count=Coalesce(Subquery(counts), 0))
+        self.stdout.write(f'Разобраны теги {total} постов')
+
+    @transaction.atomic
+    def sync(self, posts):
+        for post in posts:
+            sync_tags(post, record=False)
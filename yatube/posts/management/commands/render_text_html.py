@@ -0,0 +1,105 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.caching import bump_feed, purge_pages
+from posts.markup import excerpt, render_html
+from posts.mentions import extract_mentions, sync_mentions
+from posts.models import Comment, Group, Post, User
+from posts.signals import group_paths, profile_paths
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Заново готовит HTML текстов (text_html) всех постов и '
+        'комментариев и начала постов для лент (excerpt_html), например '
+        'после смены разметки, и заново записывает упоминания '
+        'пользователей. Работает порциями; упомянутые в порции '
+        'пользователи ищутся одним запросом. Дата изменения постов '
+        'сдвигается, а кеш лент и страниц сбрасывается, чтобы старый HTML '
+        'не отдавался из кеша.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Сколько записей обрабатывать за одну транзакцию.',
+        )
+
+    def handle(self, *args, **options):
+        for model in (Post, Comment):
+            total = self.render(model, options['chunk_size'])
+            self.stdout.write(
+                f'Подготовлен HTML {total} записей: '
+                f'{model._meta.verbose_name_plural}'
+            )
+        self.purge_caches()
+
+    def purge_caches(self):
+        """Сдвигает поколения всех лент и сбрасывает закешированные
+        страницы: HTML поменялся у всех постов и комментариев."""
+        groups = dict(Group.objects.values_list('pk', 'slug'))
+        authors = dict(User.objects.filter(posts__isnull=False).order_by(
+        ).values_list('pk', 'username').distinct())
+        bump_feed('index')
+        for group_id in groups:
+            bump_feed('group', group_id)
+        for author_id in authors:
+            bump_feed('author', author_id)
+        posts = Post.objects.order_by().values_list('pk', flat=True)
+        purge_pages(
+            reverse('posts:index'),
+            *group_paths(groups.values()),
+            *profile_paths(authors.values()),
+            *(
+                reverse('posts:post_detail', args=[pk])
+                for pk in posts.iterator()
+            ),
+        )
+
+    def render(self, model, chunk_size):
+        # Кроме текста sync_mentions нужны автор, пост и дата записи.
+        if model is Post:
+            fields = ('author_id', 'pub_date')
+        else:
+            fields = ('author_id', 'post_id', 'created')
+        records = model.objects.order_by('pk').only('pk', 'text', *fields)
+        last_pk = 0
+        total = 0
+        while True:
+            chunk = list(records.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                return total
+            last_pk = chunk[-1].pk
+            names = {
+                name for record in chunk
+                for name in extract_mentions(record.text)
+            }
+            users = dict(User.objects.filter(
+                username__in=names).values_list('username', 'pk'))
+            for record in chunk:
+                record.text_html = render_html(record.text, users)
+                if model is Post:
+                    short, record.is_truncated = excerpt(record.text)
+                    record.excerpt_html = render_html(short, users)
+            self.save(model, chunk, users)
+            total += len(chunk)
+
+    @transaction.atomic
+    def save(self, model, records, users):
+        fields = ['text_html']
+        if model is Post:
+            # bulk_update не трогает auto_now; новая дата изменения меняет
+            # ключи закешированных карточек (post_cards).
+            now = timezone.now()
+            for record in records:
+                record.updated = now
+            fields += ['excerpt_html', 'is_truncated', 'updated']
+        model.objects.bulk_update(records, fields)
+        for record in records:
+            mentioned = extract_mentions(record.text)
+            sync_mentions(record, {
+                name: users[name] for name in mentioned if name in users})
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from posts.feeds import trim_timelines
+from posts.models import TimelineEntry
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Обрезает материализованные ленты подписок до '
+        'FOLLOW_TIMELINE_LENGTH записей. Команду стоит запускать по '
+        'расписанию (cron, systemd-таймер): новые посты только добавляются '
+        'в ленты.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Сколько лент обрезать одним запросом.',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = TimelineEntry.objects.order_by('user_id').values_list(
+            'user_id', flat=True).distinct()
+        chunk = []
+        total = 0
+        for user_id in user_ids.iterator():
+            chunk.append(user_id)
+            if len(chunk) == options['chunk_size']:
+                total += trim_timelines(chunk)
+                chunk = []
+        if chunk:
+            total += trim_timelines(chunk)
+        self.stdout.write(f'Удалено записей лент: {total}')
@@ -0,0 +1,80 @@
+import re
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils.html import escape, format_html, linebreaks
+from django.utils.safestring import mark_safe
+from django.utils.text import normalize_newlines
+
+from .mentions import MENTION_RE, clean_username
+from .tags import TAG_RE, is_tag, normalize
+
+# Ссылки поглощает первая часть, TAG_RE, — обе группы у них пустые.
+TOKEN_RE = re.compile(f'{TAG_RE.pattern}|{MENTION_RE.pattern}')
+# Абзацы разделяются так же, как в linebreaks.
+PARAGRAPH_RE = re.compile(r'\n{2,}')
+
+
+def _link(match, users):
+    tag, mention = match.groups()
+    if tag is not None:
+        name = normalize(tag)
+        if is_tag(name):
+            url = reverse('posts:tag_posts', args=[name])
+            return format_html('<a href="{}">#{}</a>', url, tag)
+        return None
+    if mention is None:
+        return None
+    name = clean_username(mention)
+    if name not in users:
+        return None
+    url = reverse('posts:profile', args=[name])
+    return format_html(
+        '<a href="{}">@{}</a>{}', url, name, mention[len(name):])
+
+
+def render_text(text, users=()):
+    """Экранированный текст, в котором хештеги — ссылки на ленты тегов, а
+    упоминания пользователей из users — ссылки на их профили."""
+    parts = []
+    position = 0
+    for match in TOKEN_RE.finditer(text):
+        link = _link(match, users)
+        if link is None:
+            continue
+        parts.append(escape(text[position:match.start()]))
+        parts.append(link)
+        position = match.end()
+    parts.append(escape(text[position:]))
+    return mark_safe(''.join(parts))
+
+
+def render_html(text, users=()):
+    """HTML текста поста или комментария для хранения в text_html: абзацы
+    и переносы строк, как у фильтра linebreaks, и ссылки render_text.
+
+    Разметка из самого текста не пропускается — он целиком экранируется,
+    так что в HTML есть только теги <p>, <br> и <a> со ссылками сайта.
+    """
+    return mark_safe(linebreaks(render_text(text, users)))
+
+
+def excerpt(text):
+    """Начало текста для ленты и признак того, что текст длиннее: первые
+    POST_EXCERPT_PARAGRAPHS абзацев, но не больше POST_EXCERPT_LENGTH
+    символов. Длинное начало обрезается по границе слова, чтобы не
+    разрезать тег или упоминание."""
+    text = normalize_newlines(text).strip()
+    paragraphs = PARAGRAPH_RE.split(text)
+    count = settings.POST_EXCERPT_PARAGRAPHS
+    # Текст обрезан, если в нём больше абзацев или символов, чем в
+    # начале; лишние пустые строки между абзацами обрезкой не считаются.
+    truncated = len(paragraphs) > count
+    short = '\n\n'.join(paragraphs[:count])
+    limit = settings.POST_EXCERPT_LENGTH
+    if len(short) > limit:
+        words = short[:limit + 1].rsplit(None, 1)
+        short = words[0] if len(words) > 1 else short[:limit]
+        short = short.rstrip() + '…'
+        truncated = True
+    return short, truncated
@@ -0,0 +1,97 @@
+import re
+
+from django.conf import settings
+from django.db.models import Max
+
+from .models import Comment, Mention, MentionedPost, User
+from .tags import URL_PATTERN
+
+# «@» в начале слова; адреса почты (user@example.com) и ссылки
+# (https://example.com/@user) упоминаниями не считаются. Точка в конце —
+# знак препинания, а не часть имени.
+MENTION_RE = re.compile(rf'{URL_PATTERN}|(?<![\w@.+-])@([\w.+-]+)')
+
+
+def clean_username(name):
+    return name.rstrip('.')
+
+
+def extract_mentions(text):
+    """Имена упомянутых пользователей в порядке появления, без повторов и
+    не больше POST_MAX_MENTIONS."""
+    names = []
+    for match in MENTION_RE.finditer(text):
+        if match[1] is None:
+            continue
+        name = clean_username(match[1])
+        if name and name not in names:
+            names.append(name)
+            if len(names) == settings.POST_MAX_MENTIONS:
+                break
+    return names
+
+
+def resolve_mentions(text):
+    """{имя: id} существующих упомянутых пользователей — одним запросом
+    с IN."""
+    names = extract_mentions(text)
+    if not names:
+        return {}
+    return dict(
+        User.objects.filter(username__in=names).values_list('username', 'pk'))
+
+
+def sync_mentions(instance, users):
+    """Заменяет упоминания поста или комментария на упоминания
+    пользователей users ({имя: id}); автор сам себя не упоминает. Посты
+    в лентах упоминаний прежних и новых упомянутых обновляются."""
+    if isinstance(instance, Comment):
+        lookup = {'comment': instance}
+        post_id, pub_date = instance.post_id, instance.created
+    else:
+        lookup = {'post': instance, 'comment': None}
+        post_id, pub_date = instance.pk, instance.pub_date
+    mentions = Mention.objects.filter(**lookup)
+    user_ids = set(users.values()) - {instance.author_id}
+    previous = set(mentions.values_list('user_id', flat=True))
+    mentions.delete()
+    Mention.objects.bulk_create(
+        Mention(
+            user_id=user_id,
+            post_id=post_id,
+            comment=lookup['comment'],
+            pub_date=pub_date,
+        )
+        for user_id in user_ids
+    )
+    refresh_mentioned_posts(post_id, previous | user_ids)
+
+
+def release_mentions(comment):
+    """Убирает упоминания удаляемого комментария из лент упоминаний;
+    сами упоминания удалит каскад."""
+    user_ids = set(comment.mentions.values_list('user_id', flat=True))
+    refresh_mentioned_posts(
+        comment.post_id, user_ids, Mention.objects.exclude(comment=comment))
+
+
+def refresh_mentioned_posts(post_id, user_ids, mentions=None):
+    """Пересчитывает время последнего упоминания пользователей user_ids
+    в посте и комментариях к нему; пост без упоминаний уходит из ленты."""
+    if not user_ids:
+        return
+    if mentions is None:
+        mentions = Mention.objects.all()
+    latest = mentions.filter(
+        post_id=post_id, user_id__in=user_ids,
+    ).order_by().values('user_id').annotate(last_mentioned=Max('pub_date'))
+    MentionedPost.objects.filter(
+        post_id=post_id, user_id__in=user_ids).delete()
+    MentionedPost.objects.bulk_create(
+        MentionedPost(
+            user_id=row['user_id'],
+            post_id=post_id,
+            last_mentioned=row['last_mentioned'],
+        )
+        for row in latest
+    )
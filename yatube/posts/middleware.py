@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+from .caching import get_or_rebuild, page_cache_keys
+
+PAGE_PARAMS = ('page', 'after', 'before')
+
+
+class AnonymousPageCacheMiddleware:
+    """Кеш целых ответов лент и страниц постов для анонимных посетителей.
+
+    Стоит перед SessionMiddleware: запрос без сессионной куки получает
+    готовый ответ, не дойдя до сессий, ORM и шаблонов. Ответы сбрасываются
+    сигналами моделей через posts.caching.purge_pages; после сброса
+    страницу пересчитывает один процесс, остальные отдают прежний ответ.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        keys = self.cache_keys(request)
+        if keys is None:
+            return self.get_response(request)
+        key, stale_key = keys
+        return get_or_rebuild(
+            key,
+            lambda: self.get_response(request),
+            settings.ANONYMOUS_PAGE_CACHE_TIMEOUT,
+            stale_key=stale_key,
+            should_store=self.is_cacheable,
+        )
+
+    @staticmethod
+    def is_cacheable(response):
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+        )
+
+    def cache_keys(self, request):
+        if (
+            not settings.ANONYMOUS_PAGE_CACHE
+            or request.method != 'GET'
+            or settings.SESSION_COOKIE_NAME in request.COOKIES
+        ):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if match.view_name not in settings.ANONYMOUS_PAGE_CACHE_VIEWS:
+            return None
+        params = [
+            (name, value)
+            for name in PAGE_PARAMS
+            for value in request.GET.getlist(name)
+        ]
+        return page_cache_keys(request.path, params)
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+TOKENIZE = "tokenize = 'unicode61 remove_diacritics 2'"
+
+
+def index_table(table, source):
+    return migrations.RunSQL(
+        [
+            f'CREATE VIRTUAL TABLE {table} USING fts5(text, {TOKENIZE})',
+            f'INSERT INTO {table} (rowid, text) SELECT id, text FROM {source}',
+        ],
+        f'DROP TABLE {table}',
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_content_addressed_images'),
+    ]
+
+    operations = [
+        index_table('posts_post_fts', 'posts_post'),
+        index_table('posts_comment_fts', 'posts_comment'),
+    ]
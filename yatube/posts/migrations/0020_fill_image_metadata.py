@@ -0,0 +1,68 @@
+import hashlib
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import migrations
+from PIL import Image
+
+CHUNK_SIZE = 500
+
+# Копия posts.images.image_metadata на момент миграции: миграция не
+# зависит от того, как этот модуль поменяется потом.
+EMPTY_METADATA = {
+    'image_width': None,
+    'image_height': None,
+    'image_size': None,
+    'image_format': '',
+    'image_hash': '',
+}
+
+
+def image_metadata(file):
+    try:
+        file.open('rb')
+        try:
+            with Image.open(file) as image:
+                width, height = image.size
+                image_format = image.format
+            digest = hashlib.sha256()
+            for chunk in file.chunks():
+                digest.update(chunk)
+            size = file.size
+        finally:
+            file.close()
+    except (OSError, SuspiciousFileOperation):
+        return dict(EMPTY_METADATA)
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_size': size,
+        'image_format': image_format,
+        'image_hash': digest.hexdigest(),
+    }
+
+
+def fill_image_metadata(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    posts = Post.objects.exclude(image='').filter(
+        image_hash='').order_by('pk').only('pk', 'image')
+    last_pk = 0
+    while True:
+        chunk = list(posts.filter(pk__gt=last_pk)[:CHUNK_SIZE])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        for post in chunk:
+            for field, value in image_metadata(post.image).items():
+                setattr(post, field, value)
+        Post.objects.bulk_update(chunk, list(EMPTY_METADATA))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_text_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_image_metadata, migrations.RunPython.noop),
+    ]
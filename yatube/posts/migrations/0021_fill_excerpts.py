@@ -0,0 +1,55 @@
+import re
+
+from django.db import migrations
+from django.utils.html import escape, linebreaks
+from django.utils.text import normalize_newlines
+
+CHUNK_SIZE = 500
+
+# Копия posts.markup.excerpt и настроек POST_EXCERPT_* на момент миграции:
+# миграция не зависит от того, как они поменяются потом.
+EXCERPT_LENGTH = 500
+EXCERPT_PARAGRAPHS = 3
+PARAGRAPH_RE = re.compile(r'\n{2,}')
+
+
+def excerpt(text):
+    text = normalize_newlines(text).strip()
+    paragraphs = PARAGRAPH_RE.split(text)
+    truncated = len(paragraphs) > EXCERPT_PARAGRAPHS
+    short = '\n\n'.join(paragraphs[:EXCERPT_PARAGRAPHS])
+    if len(short) > EXCERPT_LENGTH:
+        words = short[:EXCERPT_LENGTH + 1].rsplit(None, 1)
+        short = words[0] if len(words) > 1 else short[:EXCERPT_LENGTH]
+        short = short.rstrip() + '…'
+        truncated = True
+    return short, truncated
+
+
+def fill_excerpts(apps, schema_editor):
+    """Начало текста старых постов без ссылок на теги и упоминания: их
+    добавляет команда render_text_html по текущим правилам разметки."""
+    Post = apps.get_model('posts', 'Post')
+    posts = Post.objects.filter(
+        excerpt_html='').order_by('pk').only('pk', 'text')
+    last_pk = 0
+    while True:
+        chunk = list(posts.filter(pk__gt=last_pk)[:CHUNK_SIZE])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        for post in chunk:
+            short, post.is_truncated = excerpt(post.text)
+            post.excerpt_html = linebreaks(escape(short))
+        Post.objects.bulk_update(chunk, ['excerpt_html', 'is_truncated'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_fill_image_metadata'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
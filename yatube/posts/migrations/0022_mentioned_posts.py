@@ -0,0 +1,57 @@
+# Generated by Django 2.2.16 on 2026-10-17 08:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_mentioned_posts(apps, schema_editor):
+    Mention = apps.get_model('posts', 'Mention')
+    MentionedPost = apps.get_model('posts', 'MentionedPost')
+    latest = Mention.objects.order_by().values('user', 'post').annotate(
+        last_mentioned=models.Max('pub_date'))
+    MentionedPost.objects.bulk_create(
+        (
+            MentionedPost(
+                user_id=row['user'],
+                post_id=row['post'],
+                last_mentioned=row['last_mentioned'],
+            )
+            for row in latest.iterator()
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0021_fill_excerpts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MentionedPost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_mentioned', models.DateTimeField(verbose_name='Последнее упоминание')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentioned_for', to='posts.Post', verbose_name='Пост')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentioned_posts', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Пост с упоминанием',
+                'verbose_name_plural': 'Посты с упоминаниями',
+                'ordering': ('-last_mentioned',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='mentionedpost',
+            index=models.Index(fields=['user', '-last_mentioned', '-post'], name='mentioned_post_user_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='mentionedpost',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_mentioned_post'),
+        ),
+        migrations.RunPython(fill_mentioned_posts, migrations.RunPython.noop),
+    ]
@@ -4,6 +4,8 @@ from django.conf import settings
 
 from core.models import CreatedModel
 
+from .storage import post_image_storage
+
 User = get_user_model()
 
 
@@ -27,10 +29,32 @@ class Post(models.Model):
         verbose_name='Текст поста',
         help_text='Введите текст поста'
     )
+    # Текст со ссылками на теги и упомянутых пользователей, готовится при
+    # сохранении (posts.markup), чтобы рендер не ходил за пользователями.
+    text_html = models.TextField(
+        verbose_name='Текст поста в HTML',
+        blank=True,
+        editable=False
+    )
+    # Начало текста для карточек лент: ленты не читают text и text_html.
+    excerpt_html = models.TextField(
+        verbose_name='Начало поста в HTML',
+        blank=True,
+        editable=False
+    )
+    is_truncated = models.BooleanField(
+        verbose_name='Текст длиннее начала',
+        default=False,
+        editable=False
+    )
     pub_date = models.DateTimeField(
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    updated = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True
+    )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -49,14 +73,64 @@ class Post(models.Model):
     image = models.ImageField(
         verbose_name='Картинка',
         upload_to='posts/',
+        storage=post_image_storage,
         blank=True,
         help_text='Картинка поста'
     )
+    # Сведения о картинке заполняются при сохранении по заголовку файла,
+    # чтобы шаблонам и миниатюрам не приходилось открывать исходник.
+    image_width = models.PositiveIntegerField(
+        verbose_name='Ширина картинки',
+        null=True,
+        blank=True,
+        editable=False
+    )
+    image_height = models.PositiveIntegerField(
+        verbose_name='Высота картинки',
+        null=True,
+        blank=True,
+        editable=False
+    )
+    image_size = models.PositiveIntegerField(
+        verbose_name='Размер картинки, байт',
+        null=True,
+        blank=True,
+        editable=False
+    )
+    image_format = models.CharField(
+        verbose_name='Формат картинки',
+        max_length=10,
+        blank=True,
+        editable=False
+    )
+    image_hash = models.CharField(
+        verbose_name='SHA-256 картинки',
+        max_length=64,
+        blank=True,
+        editable=False
+    )
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = "Пост"
         verbose_name_plural = "Посты"
+        # Индексы по возрастанию: в SQLite в конце индекса лежит rowid,
+        # и обратный проход даёт сразу ORDER BY pub_date DESC, id DESC.
+        indexes = [
+            models.Index(
+                fields=['pub_date'],
+                name='post_pub_date_idx'),
+            models.Index(
+                fields=['author', 'pub_date'],
+                name='post_author_pub_date_idx'),
+            models.Index(
+                fields=['group', 'pub_date'],
+                name='post_group_pub_date_idx'),
+            # Сколько постов ссылается на файл картинки: файлы общие.
+            models.Index(
+                fields=['image'],
+                name='post_image_idx'),
+        ]
 
     def __str__(self):
         return self.text[:settings.FIRST_SYMBOLS]
@@ -80,11 +154,21 @@ class Comment(CreatedModel):
         verbose_name='Текст комментария',
         help_text='Введите текст комментария'
     )
+    text_html = models.TextField(
+        verbose_name='Текст комментария в HTML',
+        blank=True,
+        editable=False
+    )
 
     class Meta:
         ordering = ('-created',)
         verbose_name = "Комментарий"
         verbose_name_plural = "Комментарии"
+        indexes = [
+            models.Index(
+                fields=['post', 'created'],
+                name='comment_post_created_idx'),
+        ]
 
     def __str__(self):
         return self.text[:settings.FIRST_SYMBOLS]
@@ -113,6 +197,256 @@ class Follow(CreatedModel):
                 fields=['user', 'author'],
                 name='unique_following'),
         ]
+        indexes = [
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user} подписан на {self.author}"
+
+
+class TimelineEntry(models.Model):
+    """Запись материализованной ленты подписок пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Пользователь'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации'
+    )
+
+    class Meta:
+        ordering = ('-pub_date',)
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Записи ленты"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', 'pub_date', 'post'],
+                name='timeline_user_pub_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.post} в ленте {self.user}"
+
+
+class UserCounter(models.Model):
+    """Денормализованные счётчики пользователя для профиля и страницы
+    поста. Поддерживаются сигналами, пересчитываются командой
+    rebuild_counters."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='counter',
+        verbose_name='Пользователь'
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Постов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        db_index=True,
+        verbose_name='Подписчиков'
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписок'
+    )
+
+    class Meta:
+        verbose_name = "Счётчики пользователя"
+        verbose_name_plural = "Счётчики пользователей"
+
+    def __str__(self):
+        return f"Счётчики {self.user}"
+
+
+class Tag(models.Model):
+    """Хештег из текстов постов; имя хранится в нижнем регистре."""
+    name = models.CharField(
+        max_length=50,
+        unique=True,
+        verbose_name='Тег'
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Постов'
+    )
+
+    class Meta:
+        ordering = ('name',)
+        verbose_name = "Тег"
+        verbose_name_plural = "Теги"
+
+    def __str__(self):
+        return f'#{self.name}'
+
+
+class PostTag(models.Model):
+    """Тег поста. Дата публикации продублирована из поста, чтобы лента
+    тега читалась проходом по индексу (tag, pub_date, post)."""
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='post_tags',
+        verbose_name='Пост'
+    )
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.CASCADE,
+        related_name='post_tags',
+        verbose_name='Тег'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации'
+    )
+
+    class Meta:
+        ordering = ('-pub_date',)
+        verbose_name = "Тег поста"
+        verbose_name_plural = "Теги постов"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['post', 'tag'],
+                name='unique_post_tag'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['tag', 'pub_date', 'post'],
+                name='post_tag_pub_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tag} у поста {self.post_id}"
+
+
+class TagActivity(models.Model):
+    """Сколько раз тег ставили в посты за час; из этих счётчиков
+    складываются популярные теги."""
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.CASCADE,
+        related_name='activity',
+        verbose_name='Тег'
+    )
+    hour = models.DateTimeField(
+        verbose_name='Час'
+    )
+    count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Постов'
+    )
+
+    class Meta:
+        verbose_name = "Активность тега"
+        verbose_name_plural = "Активность тегов"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tag', 'hour'],
+                name='unique_tag_hour'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['hour', 'tag', 'count'],
+                name='tag_activity_hour_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tag} за {self.hour:%d.%m.%Y %H}:00"
+
+
+class Mention(models.Model):
+    """Упоминание пользователя (@username) в посте или комментарии к
+    нему. Лента упоминаний читается по индексу (user, pub_date)."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='mentions',
+        verbose_name='Пользователь'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='mentions',
+        verbose_name='Пост'
+    )
+    comment = models.ForeignKey(
+        Comment,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='mentions',
+        verbose_name='Комментарий'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата упоминания'
+    )
+
+    class Meta:
+        ordering = ('-pub_date',)
+        verbose_name = "Упоминание"
+        verbose_name_plural = "Упоминания"
+        indexes = [
+            models.Index(
+                fields=['user', 'pub_date'],
+                name='mention_user_pub_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} упомянут в посте {self.post_id}"
+
+
+class MentionedPost(models.Model):
+    """Пост в ленте упоминаний пользователя: одна строка на пост, где его
+    упомянули в тексте или в комментариях, со временем последнего
+    упоминания. Лента читается проходом по индексу (user,
+    last_mentioned, post); строки поддерживает sync_mentions."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='mentioned_posts',
+        verbose_name='Пользователь'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='mentioned_for',
+        verbose_name='Пост'
+    )
+    last_mentioned = models.DateTimeField(
+        verbose_name='Последнее упоминание'
+    )
+
+    class Meta:
+        ordering = ('-last_mentioned',)
+        verbose_name = "Пост с упоминанием"
+        verbose_name_plural = "Посты с упоминаниями"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_mentioned_post'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-last_mentioned', '-post'],
+                name='mentioned_post_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} упомянут в посте {self.post_id}"
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signing import Signer
+from django.utils.crypto import constant_time_compare
+from PIL import Image, ImageOps
+
+from .storage import post_image_storage
+
+# Геометрия в адресе: «ширинаxвысота», с «c» на конце — с обрезкой.
+# Нулевая высота — пропорционально ширине.
+GEOMETRY_RE = re.compile(r'^(?P<width>\d+)x(?P<height>\d+)(?P<crop>c?)$')
+# Расширение варианта по расширению исходника; GIF отдаётся первым
+# кадром в PNG.
+EXTENSIONS = {
+    '.jpg': '.jpg', '.jpeg': '.jpg', '.png': '.png', '.webp': '.webp',
+}
+FORMATS = {'.jpg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP'}
+
+_signer = Signer(salt='posts.resize')
+
+
+def geometry_string(width, height=0, crop=False):
+    return f'{width}x{height}{"c" if crop else ""}'
+
+
+def parse_geometry(geometry):
+    """(ширина, высота, обрезка) из строки геометрии; ValueError, если
+    строка неверна или размеры вне RESIZE_MAX_DIMENSION."""
+    match = GEOMETRY_RE.match(geometry)
+    if match is None:
+        raise ValueError(geometry)
+    width, height = int(match['width']), int(match['height'])
+    crop = bool(match['crop'])
+    limit = settings.RESIZE_MAX_DIMENSION
+    if not 0 < width <= limit or not 0 <= height <= limit:
+        raise ValueError(geometry)
+    if crop and not height:
+        raise ValueError(geometry)
+    return width, height, crop
+
+
+def sign(name, geometry):
+    return _signer.signature(f'{geometry}/{name}')
+
+
+def check_signature(name, geometry, signature):
+    return constant_time_compare(sign(name, geometry), signature)
+
+
+def cache_name(name, geometry):
+    """Путь варианта относительно MEDIA_ROOT. Каталог шардируется по
+    первым знакам хеша, чтобы в одном каталоге не копились тысячи
+    файлов."""
+    digest = hashlib.sha256(f'{geometry}/{name}'.encode()).hexdigest()
+    extension = EXTENSIONS.get(os.path.splitext(name)[1].lower(), '.png')
+    return os.path.join(
+        settings.RESIZE_CACHE_DIR, digest[:2], digest[2:4],
+        digest + extension,
+    )
+
+
+def _render(name, width, height, crop, extension):
+    with post_image_storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        if crop:
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            image.thumbnail(
+                (width, height or width * 100), Image.LANCZOS,
+                reducing_gap=3.0,
+            )
+        image_format = FORMATS[extension]
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode == 'P':
+            image = image.convert('RGBA')
+        options = {'optimize': True}
+        if image_format == 'JPEG':
+            options.update(quality=settings.POST_IMAGE_QUALITY,
+                           progressive=True)
+        elif image_format == 'WEBP':
+            options = {'quality': settings.POST_IMAGE_WEBP_QUALITY}
+        return image, image_format, options
+
+
+def _write(path, image, image_format, options):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            image.save(file, image_format, **options)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def resized(name, width, height=0, crop=False):
+    """Путь (относительно MEDIA_ROOT) варианта картинки поста name нужного
+    размера; None, если исходника нет.
+
+    Готовый вариант берётся с диска, новый создаётся и записывается
+    атомарно. Время изменения файла служит временем последнего чтения
+    для вытеснения (cull, команда cull_resized_images) и обновляется не
+    чаще RESIZE_CACHE_TOUCH_INTERVAL секунд.
+    """
+    if not post_image_storage.exists(name):
+        return None
+    relative = cache_name(name, geometry_string(width, height, crop))
+    path = os.path.join(settings.MEDIA_ROOT, relative)
+    try:
+        modified = os.path.getmtime(path)
+    except OSError:
+        extension = os.path.splitext(relative)[1]
+        _write(path, *_render(name, width, height, crop, extension))
+    else:
+        if time.time() - modified > settings.RESIZE_CACHE_TOUCH_INTERVAL:
+            os.utime(path)
+    return relative
+
+
+def _cached_files(root):
+    """(время чтения, размер, путь) всех вариантов в кеше."""
+    for directory, _, names in os.walk(root):
+        for filename in names:
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+
+def _evict(files, total):
+    """Удаляет файлы от давно не читавшихся, пока их общий размер больше
+    RESIZE_CACHE_MAX_SIZE; возвращает число удалённых."""
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= settings.RESIZE_CACHE_MAX_SIZE:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def cull():
+    """Удаляет давно не читавшиеся варианты, пока кеш больше
+    RESIZE_CACHE_MAX_SIZE байт, и возвращает их число. Обходит весь кеш,
+    поэтому вызывается командой cull_resized_images по расписанию, а не
+    из запросов. Одновременно чистит один процесс."""
+    if not cache.add('resize:cull', True, settings.CACHE_LOCK_TIMEOUT):
+        return 0
+    try:
+        root = os.path.join(settings.MEDIA_ROOT, settings.RESIZE_CACHE_DIR)
+        files = list(_cached_files(root))
+        return _evict(files, sum(size for _, size, _ in files))
+    finally:
+        cache.delete('resize:cull')
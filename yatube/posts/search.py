@@ -0,0 +1,127 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .feeds import deferred_text
+from .models import Comment, Post
+from .utils import CursorPaginator, decode_key, encode_key
+
+# Полнотекстовые индексы SQLite FTS5 (миграция 0015_search_index): строка
+# индекса хранит текст записи, rowid совпадает с её id.
+INDEXES = {
+    Post: 'posts_post_fts',
+    Comment: 'posts_comment_fts',
+}
+
+WORD_RE = re.compile(r'\w+')
+
+
+def match_expression(query):
+    """Запрос FTS5 из пользовательской строки: все слова обязательны,
+    последнее ищется по префиксу, как при наборе. None, если слов нет.
+
+    Слова берутся в кавычки, так что синтаксис FTS5 (NEAR, OR, «*»,
+    скобки) из строки не интерпретируется.
+    """
+    words = WORD_RE.findall(query)[:settings.SEARCH_MAX_WORDS]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def index(instance):
+    """Записывает текст записи в её полнотекстовый индекс."""
+    table = INDEXES[type(instance)]
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [instance.pk])
+        cursor.execute(
+            f'INSERT INTO {table} (rowid, text) VALUES (%s, %s)',
+            [instance.pk, instance.text],
+        )
+
+
+def unindex(instance):
+    table = INDEXES[type(instance)]
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [instance.pk])
+
+
+def rebuild(model):
+    """Перестраивает индекс модели по её таблице."""
+    table = INDEXES[model]
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.execute(
+            f'INSERT INTO {table} (rowid, text) '
+            f'SELECT id, text FROM {model._meta.db_table}'
+        )
+
+
+def filter_queryset(queryset, query):
+    """Записи queryset, текст которых подходит под запрос, — одним
+    подзапросом к индексу вместо LIKE по всей таблице."""
+    expression = match_expression(query)
+    if expression is None:
+        return queryset.none()
+    table = INDEXES[queryset.model]
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {table} WHERE {table} MATCH %s', [expression]))
+
+
+def encode_cursor(found):
+    """Токен позиции в выдаче: (релевантность, id)."""
+    return encode_key(repr(found.search_rank), found.pk)
+
+
+def decode_cursor(token):
+    return decode_key(token, float, int)
+
+
+class SearchResults:
+    """Записи queryset (по умолчанию посты) по запросу, упорядоченные по
+    релевантности (BM25), затем по id. Листается курсорами через
+    SearchPaginator: каждая страница — один запрос к индексу с LIMIT и
+    один запрос за записями."""
+
+    def __init__(self, query, queryset=None):
+        self.expression = match_expression(query)
+        if queryset is None:
+            queryset = Post.objects.select_related('author', 'group').defer(
+                *deferred_text())
+        self.queryset = queryset
+
+    def seek(self, key, newer, limit):
+        if self.expression is None:
+            return []
+        table = INDEXES[self.queryset.model]
+        # Меньший rank у FTS5 означает более релевантную запись.
+        sql = f'SELECT rowid, rank FROM {table} WHERE {table} MATCH %s'
+        params = [self.expression]
+        lookup, order = ('<', 'DESC') if newer else ('>', 'ASC')
+        if key is not None:
+            rank, pk = key
+            sql += (
+                f' AND (rank {lookup} %s OR (rank = %s AND rowid {lookup} %s))'
+            )
+            params += [rank, rank, pk]
+        sql += f' ORDER BY rank {order}, rowid {order} LIMIT %s'
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            ranks = dict(cursor.fetchall())
+        objects = self.queryset.in_bulk(list(ranks))
+        found = []
+        for pk, rank in ranks.items():
+            if pk in objects:
+                objects[pk].search_rank = rank
+                found.append(objects[pk])
+        return found
+
+
+class SearchPaginator(CursorPaginator):
+    encode_cursor = staticmethod(encode_cursor)
+    decode_cursor = staticmethod(decode_cursor)
@@ -0,0 +1,254 @@
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete, post_init, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+from django.urls import NoReverseMatch, reverse
+
+from . import counters, feeds, search, tags
+from .caching import bump_feed, bump_post_feeds, purge_pages
+from .images import image_metadata, webp_name
+from .markup import excerpt, render_html
+from .mentions import release_mentions, resolve_mentions, sync_mentions
+from .models import Comment, Follow, Group, Post, User, UserCounter
+from .thumbnails import delete_thumbnails, thumbnails_ready
+
+
+def profile_path(user_id):
+    username = User.objects.values_list('username', flat=True).get(
+        pk=user_id)
+    return reverse('posts:profile', args=[username])
+
+
+def profile_paths(usernames):
+    for username in usernames:
+        yield reverse('posts:profile', args=[username])
+
+
+def group_paths(slugs):
+    for slug in slugs:
+        try:
+            yield reverse('posts:group_list', args=[slug])
+        except NoReverseMatch:
+            # Слаг, заведённый в обход SlugField, страницы не имеет.
+            continue
+
+
+def purge_post_pages(post, group_ids):
+    """Сбрасывает кеш анонимных страниц, на которых виден пост."""
+    slugs = Group.objects.filter(
+        pk__in={post.group_id, *group_ids} - {None}
+    ).values_list('slug', flat=True)
+    purge_pages(
+        reverse('posts:index'),
+        reverse('posts:post_detail', args=[post.pk]),
+        profile_path(post.author_id),
+        *group_paths(slugs),
+    )
+
+
+def release_image(name):
+    """После фиксации транзакции удаляет файл картинки вместе с WebP-
+    вариантом и миниатюрами, если на него больше не ссылается ни один пост.
+
+    Файлы общие для одинаковых загрузок (posts.storage), поэтому число
+    ссылок считается по всем постам; только что сохранённый файл не
+    трогается — его может ждать ещё не записанный пост.
+    """
+    def release():
+        storage = Post._meta.get_field('image').storage
+        try:
+            if (
+                Post.objects.filter(image=name).exists()
+                or storage.recently_saved(name)
+            ):
+                return
+            delete_thumbnails(name, storage)
+            storage.delete(webp_name(name))
+            storage.delete(name)
+        except SuspiciousFileOperation:
+            # Имя вне MEDIA_ROOT, записанное в обход формы: файл не наш.
+            return
+
+    if name:
+        transaction.on_commit(release)
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    if created:
+        UserCounter.objects.get_or_create(user=instance)
+
+
+@receiver(post_init, sender=Post)
+def post_loaded(sender, instance, **kwargs):
+    # Группа до редактирования: при переносе поста меняются обе ленты.
+    instance._loaded_group_id = instance.group_id
+    instance._loaded_image_name = loaded_image_name(instance)
+
+
+def loaded_image_name(post):
+    # Без обращения к дескриптору: поле может быть отложено через defer(),
+    # тогда прежнее имя неизвестно (None).
+    if 'image' not in post.__dict__:
+        return None
+    image = post.__dict__['image']
+    return getattr(image, 'name', image) or ''
+
+
+@receiver(pre_save, sender=Post)
+def post_image_changed(sender, instance, **kwargs):
+    image = instance.image
+    loaded_name = instance._loaded_image_name
+    if (
+        instance._state.adding
+        or not image._committed
+        or loaded_name is not None and (image.name or '') != loaded_name
+    ):
+        for field, value in image_metadata(image).items():
+            setattr(instance, field, value)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.bump(instance.author_id, posts_count=1)
+        feeds.fan_out(instance)
+    bump_post_feeds(instance, {instance._loaded_group_id})
+    purge_post_pages(instance, {instance._loaded_group_id})
+    image_name = instance.image.name or ''
+    if instance._loaded_image_name not in (None, image_name):
+        release_image(instance._loaded_image_name)
+    instance._loaded_group_id = instance.group_id
+    instance._loaded_image_name = image_name
+
+
+@receiver(post_save, sender=Post)
+def store_image_variants(sender, instance, **kwargs):
+    # Варианты картинки (например, WebP), подготовленные PostForm, ложатся
+    # рядом с сохранённым файлом, чьё имя известно только после save().
+    # У общего файла вариант уже мог записать другой пост.
+    variants = getattr(instance, '_image_variants', None)
+    if not variants or not instance.image:
+        return
+    for suffix, content in variants.items():
+        instance.image.storage.write(
+            instance.image.name + suffix, ContentFile(content))
+    instance._image_variants = None
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.bump(instance.author_id, posts_count=-1)
+    bump_post_feeds(instance, {instance._loaded_group_id})
+    purge_post_pages(instance, {instance._loaded_group_id})
+    release_image(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    purge_pages(reverse('posts:post_detail', args=[instance.post_id]))
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    # Название группы выводится в карточках постов на главной и в профилях;
+    # при удалении авторов ищем до того, как у постов обнулится группа.
+    # Авторы и их имена — одним запросом на группу, а не по запросу на
+    # автора.
+    authors = User.objects.filter(posts__group=instance).order_by()
+    authors = dict(authors.values_list('pk', 'username').distinct())
+    bump_feed('index')
+    bump_feed('group', instance.pk)
+    for author_id in authors:
+        bump_feed('author', author_id)
+    purge_pages(
+        reverse('posts:index'),
+        *group_paths([instance.slug]),
+        *profile_paths(authors.values()),
+    )
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        counters.bump(instance.author_id, followers_count=1)
+        counters.bump(instance.user_id, following_count=1)
+        feeds.backfill(instance.user, instance.author)
+        purge_pages(
+            profile_path(instance.author_id), profile_path(instance.user_id))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.bump(instance.author_id, followers_count=-1)
+    counters.bump(instance.user_id, following_count=-1)
+    feeds.prune(instance.user, instance.author)
+    feeds.follower_removed(instance.author_id)
+    purge_pages(
+        profile_path(instance.author_id), profile_path(instance.user_id))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+def text_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'text' in update_fields:
+        search.index(instance)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+def text_deleted(sender, instance, **kwargs):
+    search.unindex(instance)
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Comment)
+def render_text_html(sender, instance, update_fields=None, **kwargs):
+    # Текст размечается один раз при сохранении, а не при каждом рендере;
+    # упомянутые пользователи ищутся одним запросом.
+    if update_fields is None or 'text' in update_fields:
+        instance._mentioned_users = resolve_mentions(instance.text)
+        instance.text_html = render_html(
+            instance.text, instance._mentioned_users)
+        if isinstance(instance, Post):
+            short, instance.is_truncated = excerpt(instance.text)
+            instance.excerpt_html = render_html(
+                short, instance._mentioned_users)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+def mentions_changed(sender, instance, **kwargs):
+    users = getattr(instance, '_mentioned_users', None)
+    if users is not None:
+        sync_mentions(instance, users)
+        instance._mentioned_users = None
+
+
+@receiver(pre_delete, sender=Comment)
+def comment_mentions_released(sender, instance, **kwargs):
+    release_mentions(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_tags_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'text' in update_fields:
+        tags.sync_tags(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def post_tags_released(sender, instance, **kwargs):
+    tags.release_tags(instance)
+
+
+@receiver(thumbnails_ready)
+def thumbnails_generated(sender, name, **kwargs):
+    # Страницы, отрендеренные до готовности миниатюр, показаны без картинки.
+    for post in Post.objects.filter(image=name):
+        bump_post_feeds(post)
+        purge_post_pages(post, ())
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла — SHA-256 его содержимого.
+
+    Одинаковые загрузки ложатся в один файл
+    ``<каталог>/<первые два знака хеша>/<хеш><расширение>``, а значит
+    делят и миниатюры sorl-thumbnail. Повторная загрузка существующего
+    файла ничего не пишет, только обновляет время изменения, чтобы
+    освобождение файла (posts.signals.release_image) не удалило его,
+    пока новый пост ещё не сохранён.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Одно содержимое — одно имя: совпадение имён не конфликт.
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, digest[:2], digest + extension)
+        if self.exists(name):
+            os.utime(self.path(name))
+            return name
+        self.write(name, content)
+        return name
+
+    def write(self, name, content):
+        """Записывает файл ровно под именем name; если файл уже есть,
+        оставляет его. Запись атомарна: читатели не видят файл
+        недописанным."""
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary, self.file_permissions_mode)
+            try:
+                os.link(temporary, full_path)
+            except FileExistsError:
+                pass
+        finally:
+            os.unlink(temporary)
+        return name
+
+    def recently_saved(self, name):
+        """Сохранялся ли файл (в том числе повторно) в течение
+        POST_IMAGE_RELEASE_GRACE секунд."""
+        try:
+            modified = os.path.getmtime(self.path(name))
+        except OSError:
+            return False
+        return time.time() - modified < settings.POST_IMAGE_RELEASE_GRACE
+
+
+post_image_storage = ContentAddressedStorage()
@@ -0,0 +1,128 @@
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import PostTag, Tag, TagActivity
+
+# Ссылка целиком, вплоть до пробела. Регулярки тегов и упоминаний
+# сначала пробуют её и получают совпадение с пустой группой, так что
+# #фрагмент или /@имя внутри адреса не разбираются.
+URL_PATTERN = r'(?:https?://|www\.)\S+'
+# «#» в начале слова; «#» внутри слова (a#b, &#39;) или после «/»
+# (/#фрагмент) тегом не считается.
+TAG_RE = re.compile(rf'{URL_PATTERN}|(?<![\w#&/])#(\w+)')
+TRENDING_KEY = 'trending_tags'
+
+
+def normalize(name):
+    return name.casefold()
+
+
+def max_length():
+    return Tag._meta.get_field('name').max_length
+
+
+def is_tag(name):
+    return not name.isdigit() and len(name) <= max_length()
+
+
+def extract_tags(text):
+    """Нормализованные теги текста в порядке появления, без повторов и
+    не больше POST_MAX_TAGS. Числа (#1) и слишком длинные слова тегами
+    не считаются."""
+    names = []
+    for match in TAG_RE.finditer(text):
+        if match[1] is None:
+            continue
+        name = normalize(match[1])
+        if is_tag(name) and name not in names:
+            names.append(name)
+            if len(names) == settings.POST_MAX_TAGS:
+                break
+    return names
+
+
+def current_hour():
+    return timezone.now().replace(minute=0, second=0, microsecond=0)
+
+
+def record_activity(tag_ids):
+    """Прибавляет по единице к счётчикам тегов за текущий час."""
+    hour = current_hour()
+    TagActivity.objects.bulk_create(
+        [TagActivity(tag_id=tag_id, hour=hour) for tag_id in tag_ids],
+        ignore_conflicts=True,
+    )
+    TagActivity.objects.filter(tag_id__in=tag_ids, hour=hour).update(
+        count=F('count') + 1)
+
+
+def sync_tags(post, record=True):
+    """Приводит теги поста в соответствие с его текстом и поправляет
+    счётчики тегов. record=False не учитывает новые теги в популярных
+    (например, при пересчёте старых постов)."""
+    names = set(extract_tags(post.text))
+    current = dict(post.post_tags.values_list('tag__name', 'tag_id'))
+    added = names - set(current)
+    removed = [tag_id for name, tag_id in current.items() if name not in names]
+    if removed:
+        PostTag.objects.filter(post=post, tag_id__in=removed).delete()
+        Tag.objects.filter(pk__in=removed).update(
+            posts_count=F('posts_count') - 1)
+    if not added:
+        return
+    Tag.objects.bulk_create(
+        [Tag(name=name) for name in added], ignore_conflicts=True)
+    added_ids = list(
+        Tag.objects.filter(name__in=added).values_list('pk', flat=True))
+    PostTag.objects.bulk_create(
+        PostTag(post=post, tag_id=tag_id, pub_date=post.pub_date)
+        for tag_id in added_ids
+    )
+    Tag.objects.filter(pk__in=added_ids).update(
+        posts_count=F('posts_count') + 1)
+    if record:
+        record_activity(added_ids)
+
+
+def release_tags(post):
+    """Уменьшает счётчики тегов удаляемого поста; сами связи удалит
+    каскад."""
+    Tag.objects.filter(post_tags__post=post).update(
+        posts_count=F('posts_count') - 1)
+
+
+def trending_since():
+    return current_hour() - timedelta(hours=settings.TAG_TRENDING_HOURS)
+
+
+def prune_activity():
+    """Удаляет почасовые счётчики старше окна популярных тегов; вызывается
+    командой prune_tag_activity по расписанию. Возвращает число удалённых
+    счётчиков."""
+    deleted, _ = TagActivity.objects.filter(
+        hour__lt=trending_since()).delete()
+    return deleted
+
+
+def trending_tags():
+    """Теги, которые чаще всего ставили за последние TAG_TRENDING_HOURS
+    часов. Суммы почасовых счётчиков кешируются на
+    TAG_TRENDING_CACHE_TIMEOUT секунд."""
+    tags = cache.get(TRENDING_KEY)
+    if tags is not None:
+        return tags
+    since = trending_since()
+    totals = list(
+        TagActivity.objects.filter(hour__gte=since).values('tag').annotate(
+            total=Sum('count')).order_by('-total', 'tag').values_list(
+            'tag', 'total')[:settings.TAG_TRENDING_COUNT]
+    )
+    names = Tag.objects.in_bulk([tag_id for tag_id, _ in totals])
+    tags = [names[tag_id] for tag_id, _ in totals if tag_id in names]
+    cache.set(TRENDING_KEY, tags, settings.TAG_TRENDING_CACHE_TIMEOUT)
+    return tags
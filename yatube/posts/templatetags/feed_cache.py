@@ -0,0 +1,59 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from ..caching import get_or_rebuild
+
+register = template.Library()
+
+
+class FeedCacheNode(template.Node):
+    def __init__(self, nodelist, expire_time, fragment_name, vary_on,
+                 version):
+        self.nodelist = nodelist
+        self.expire_time = expire_time
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+        self.version = version
+
+    def render(self, context):
+        expire_time = int(self.expire_time.resolve(context))
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        stale_key = make_template_fragment_key(self.fragment_name, vary_on)
+        key = make_template_fragment_key(
+            self.fragment_name, vary_on + [self.version.resolve(context)])
+        return get_or_rebuild(
+            key,
+            lambda: self.nodelist.render(context),
+            expire_time,
+            stale_key=stale_key,
+        )
+
+
+@register.tag
+def feed_cache(parser, token):
+    """Кеш фрагмента ленты с защитой от одновременного пересчёта.
+
+    Использование::
+
+        {% feed_cache 3600 index_page page_obj.number version=feed_version %}
+            ...
+        {% endfeed_cache %}
+
+    Как {% cache %}, но после смены поколения ленты (version) фрагмент
+    пересчитывает только один процесс, остальные отдают прежний вариант.
+    """
+    nodelist = parser.parse(('endfeed_cache',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    if len(tokens) < 4 or not tokens[-1].startswith('version='):
+        raise template.TemplateSyntaxError(
+            f'{tokens[0]} tag requires an expire time, a fragment name '
+            f'and a version= argument.'
+        )
+    return FeedCacheNode(
+        nodelist,
+        parser.compile_filter(tokens[1]),
+        tokens[2],
+        [parser.compile_filter(var) for var in tokens[3:-1]],
+        parser.compile_filter(tokens[-1][len('version='):]),
+    )
@@ -0,0 +1,60 @@
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from ..thumbnails import collect_pending, prefetch_thumbnails
+
+register = template.Library()
+
+
+def card_key(post, show_author, show_group):
+    """Ключ карточки поста: id, время последнего изменения, набор флагов и
+    отпечаток выводимых в карточке имени автора и названия группы."""
+    shown = []
+    if show_author:
+        shown += [post.author.username, post.author.get_full_name()]
+    if show_group and post.group_id:
+        shown += [post.group.slug, post.group.title]
+    digest = hashlib.md5('\0'.join(shown).encode()).hexdigest()[:12]
+    return (
+        f'post_card:{post.pk}:{post.updated.timestamp()}:'
+        f'{show_author:d}{show_group:d}:{digest}'
+    )
+
+
+@register.simple_tag
+def post_cards(posts, show_author=False, show_group=False):
+    """Список HTML-карточек постов ленты: готовые берутся из кеша одним
+    get_many, недостающие рендерятся из includes/post.html и кешируются.
+
+    Записи о миниатюрах недостающих карточек читаются одним запросом к
+    кешу. Карточка, отрендеренная до готовности миниатюры, не кешируется.
+    """
+    keys = {card_key(post, show_author, show_group): post for post in posts}
+    cards = cache.get_many(keys)
+    missing = {key: post for key, post in keys.items() if key not in cards}
+    rendered = {}
+    with prefetch_thumbnails(missing.values()):
+        for key, post in missing.items():
+            with collect_pending() as pending:
+                cards[key] = render_to_string('includes/post.html', {
+                    'post': post,
+                    'show_author': show_author,
+                    'show_group': show_group,
+                })
+            if not pending:
+                rendered[key] = cards[key]
+    if rendered:
+        cache.set_many(rendered, settings.POST_CARD_CACHE_TIMEOUT)
+    return [mark_safe(cards[key]) for key in keys]
+
+
+@register.filter
+def zip_cards(posts, cards):
+    """Пары (пост, карточка) для лент, которым рядом с карточкой из
+    post_cards нужны сведения о самом посте."""
+    return zip(posts, cards)
@@ -0,0 +1,62 @@
+from django import template
+from django.conf import settings
+from django.urls import reverse
+from django.utils.html import format_html
+
+from ..resize import geometry_string, sign
+from ..thumbnails import ready_thumbnail
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_image(post, css_class='card-img my-2'):
+    """<img> картинки поста с набором миниатюр POST_THUMBNAILS в srcset.
+
+    width/height берутся у миниатюры POST_THUMBNAIL_DEFAULT, чтобы браузер
+    заранее резервировал место; картинка грузится лениво. Пока миниатюры
+    не готовы, ничего не выводится. Картинка без сведений о ней (пустой
+    image_format: файл не удалось прочитать) выводится как есть, без
+    миниатюр, чтобы не декодировать её при каждом рендере.
+    """
+    image = post.image
+    if not image:
+        return ''
+    if not post.image_format:
+        return format_html(
+            '<img class="{}" src="{}" loading="lazy" alt="">',
+            css_class, image.url,
+        )
+    thumbnails = {}
+    for geometry, options in settings.POST_THUMBNAILS:
+        thumbnail = ready_thumbnail(image, geometry, **options)
+        if thumbnail is not None:
+            thumbnails[geometry] = thumbnail
+    default = thumbnails.get(settings.POST_THUMBNAIL_DEFAULT)
+    if default is None:
+        return ''
+    srcset = ', '.join(
+        f'{thumbnail.url} {thumbnail.width}w'
+        for thumbnail in thumbnails.values()
+    )
+    return format_html(
+        '<img class="{}" src="{}" srcset="{}" sizes="{}" width="{}" '
+        'height="{}" loading="lazy" alt="">',
+        css_class, default.url, srcset, settings.POST_IMAGE_SIZES,
+        default.width, default.height,
+    )
+
+
+@register.simple_tag
+def resized_url(image, width, height=0, crop=False):
+    """Подписанный адрес варианта картинки поста нужного размера:
+    {% resized_url post.image 640 480 crop=True %}. Вариант создаётся
+    при первом запросе к адресу, а не при рендере страницы."""
+    if not image:
+        return ''
+    geometry = geometry_string(width, height, crop)
+    return reverse('posts:resize', kwargs={
+        'signature': sign(image.name, geometry),
+        'geometry': geometry,
+        'name': image.name,
+    })
@@ -0,0 +1,89 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.template import Context, Template
+from django.test import SimpleTestCase, override_settings
+
+from ..caching import get_or_rebuild
+
+
+@override_settings(CACHE_LOCK_WAIT=0.1)
+class GetOrRebuildTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_rebuilds_once_and_caches(self):
+        """Значение пересчитывается один раз и затем берётся из кеша."""
+        rebuild = mock.Mock(return_value='value')
+        self.assertEqual(get_or_rebuild('key', rebuild, 60), 'value')
+        self.assertEqual(get_or_rebuild('key', rebuild, 60), 'value')
+        rebuild.assert_called_once()
+
+    def test_locked_rebuild_serves_stale_value(self):
+        """Пока другой процесс пересчитывает, отдаётся прежнее значение
+        по ключу без поколения."""
+        get_or_rebuild('key:1', lambda: 'old', 60, stale_key='key')
+        cache.add('lock:key:2', True, 30)
+        rebuild = mock.Mock(return_value='new')
+        self.assertEqual(
+            get_or_rebuild('key:2', rebuild, 60, stale_key='key'), 'old')
+        rebuild.assert_not_called()
+
+    def test_locked_rebuild_without_stale_value(self):
+        """Если отдать нечего и пересчёт не дождались, значение
+        считается на месте без записи в кеш."""
+        cache.add('lock:key', True, 30)
+        self.assertEqual(get_or_rebuild('key', lambda: 'value', 60), 'value')
+        self.assertIsNone(cache.get('key'))
+
+    def test_lock_released_after_error(self):
+        """Ошибка пересчёта снимает блокировку."""
+        with self.assertRaises(RuntimeError):
+            get_or_rebuild('key', mock.Mock(side_effect=RuntimeError), 60)
+        self.assertIsNone(cache.get('lock:key'))
+
+    def test_should_store(self):
+        """Значение, отвергнутое should_store, не кешируется."""
+        get_or_rebuild('key', lambda: 'error', 60, should_store=bool)
+        get_or_rebuild('key', lambda: '', 60, should_store=bool)
+        self.assertEqual(cache.get('key')[0], 'error')
+        cache.delete('key')
+        get_or_rebuild('key', lambda: '', 60, should_store=bool)
+        self.assertIsNone(cache.get('key'))
+
+    def test_early_refresh(self):
+        """Близкая к истечению запись пересчитывается заранее."""
+        get_or_rebuild('key', lambda: 'old', 60)
+        with mock.patch(
+            'posts.caching._should_refresh_early', return_value=True
+        ):
+            self.assertEqual(get_or_rebuild('key', lambda: 'new', 60), 'new')
+        self.assertEqual(get_or_rebuild('key', lambda: 'other', 60), 'new')
+
+
+class FeedCacheTagTest(SimpleTestCase):
+    template = Template(
+        '{% load feed_cache %}'
+        '{% feed_cache 60 fragment page version=version %}'
+        '{{ text }}{% endfeed_cache %}'
+    )
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self, **context):
+        return self.template.render(Context(context))
+
+    def test_fragment_depends_on_version(self):
+        """Фрагмент кешируется в пределах поколения ленты."""
+        self.assertEqual(self.render(page=1, version=1, text='a'), 'a')
+        self.assertEqual(self.render(page=1, version=1, text='b'), 'a')
+        self.assertEqual(self.render(page=2, version=1, text='b'), 'b')
+        self.assertEqual(self.render(page=1, version=2, text='c'), 'c')
+
+    def test_stale_fragment_while_locked(self):
+        """Во время чужого пересчёта нового поколения отдаётся прежний
+        фрагмент."""
+        self.render(page=1, version=1, text='a')
+        with mock.patch('posts.caching.cache.add', return_value=False):
+            self.assertEqual(self.render(page=1, version=2, text='b'), 'a')
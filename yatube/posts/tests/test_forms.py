@@ -1,5 +1,12 @@
+import hashlib
+import os
 import shutil
+import struct
 import tempfile
+import unittest
+import zlib
+from io import BytesIO
+from unittest import mock
 
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
@@ -7,11 +14,22 @@ from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from http import HTTPStatus
+from PIL import Image, features
+
+from ..images import webp_name
 from ..models import Group, Post, User, Comment
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
+def stored_name(uploaded):
+    """Имя, под которым posts.storage сохраняет загруженный файл."""
+    uploaded.seek(0)
+    digest = hashlib.sha256(uploaded.read()).hexdigest()
+    extension = os.path.splitext(uploaded.name)[1]
+    return f'posts/{digest[:2]}/{digest}{extension}'
+
+
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostCreateFormTests(TestCase):
     @classmethod
@@ -79,7 +97,7 @@ class PostCreateFormTests(TestCase):
                 text=form_data['text'],
                 author=PostCreateFormTests.author,
                 group=form_data['group'],
-                image='posts/small.gif',
+                image=stored_name(uploaded),
             ).exists()
         )
         self.assertEqual(response.status_code, HTTPStatus.OK)
@@ -161,7 +179,7 @@ class PostCreateFormTests(TestCase):
                 text=form_data['text'],
                 author=PostCreateFormTests.author,
                 group=form_data['group'],
-                image='posts/small_2.gif',
+                image=stored_name(uploaded),
             ).exists()
         )
         self.assertEqual(response.status_code, HTTPStatus.OK)
@@ -289,3 +307,135 @@ class PostCreateFormTests(TestCase):
         test_comment_text = 'Тестовый комментарий'
         response_comment_text = response.context['comments'][0].text
         self.assertEqual(test_comment_text, response_comment_text)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class PostImageIngestionTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(PostImageIngestionTests.author)
+
+    def upload(self, name, size, image_format):
+        image = Image.new('RGB', size, color=(200, 30, 30))
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: повернуть на 90° по часовой
+        exif[0x010F] = 'Камера'
+        buffer = BytesIO()
+        image.save(buffer, image_format, exif=exif.tobytes())
+        return SimpleUploadedFile(
+            name, buffer.getvalue(), Image.MIME[image_format])
+
+    def create_post(self, image):
+        self.authorized_client.post(reverse('posts:post_create'), data={
+            'text': 'Пост с фотографией',
+            'image': image,
+        })
+        return Post.objects.get(text='Пост с фотографией')
+
+    @override_settings(POST_IMAGE_MAX_SIZE=(400, 400))
+    def test_uploaded_photo_is_downscaled_and_stripped(self):
+        """Фотография уменьшается, поворачивается по EXIF и сохраняется без
+        метаданных."""
+        post = self.create_post(self.upload('photo.jpg', (1200, 600), 'JPEG'))
+        self.assertRegex(post.image.name, r'^posts/\w\w/\w{64}\.jpg$')
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.format, 'JPEG')
+            self.assertEqual(stored.size, (200, 400))
+            self.assertEqual(dict(stored.getexif()), {})
+
+    def test_other_formats_are_converted_to_jpeg(self):
+        """Картинки в прочих форматах перекодируются в JPEG."""
+        post = self.create_post(self.upload('scan.tiff', (60, 40), 'TIFF'))
+        self.assertRegex(post.image.name, r'\.jpg$')
+
+    @unittest.skipUnless(features.check('webp'), 'Pillow собран без WebP')
+    def test_webp_variant_is_stored_next_to_image(self):
+        """Рядом с картинкой сохраняется её WebP-вариант."""
+        post = self.create_post(self.upload('variant.png', (60, 40), 'PNG'))
+        storage = post.image.storage
+        self.assertTrue(storage.exists(webp_name(post.image.name)))
+
+    def mpo(self):
+        """JPEG с блоком MPF и вторым кадром, как у снимков с телефонов:
+        Pillow открывает его как MPO."""
+        first, second = (
+            self.upload(f'{name}.jpg', (40, 30), 'JPEG').read()
+            for name in ('first', 'second')
+        )
+        entries_offset = 8 + 2 + 3 * 12 + 4
+        app2_length = 2 + 4 + entries_offset + 32
+        size = len(first) + 2 + app2_length
+        # Смещения кадров отсчитываются от заголовка TIFF внутри APP2.
+        tiff_start = 2 + 2 + 2 + 4
+        app2 = (
+            b'\xff\xe2' + struct.pack('>H', app2_length) + b'MPF\x00'
+            + b'II*\x00' + struct.pack('<IH', 8, 3)
+            + struct.pack('<HHI4s', 0xB000, 7, 4, b'0100')
+            + struct.pack('<HHII', 0xB001, 4, 1, 2)
+            + struct.pack('<HHII', 0xB002, 7, 32, entries_offset)
+            + struct.pack('<I', 0)
+            + struct.pack('<IIIHH', 0x20030000, size, 0, 0, 0)
+            + struct.pack(
+                '<IIIHH', 0x00020002, len(second), size - tiff_start, 0, 0)
+        )
+        content = first[:2] + app2 + first[2:] + second
+        with Image.open(BytesIO(content)) as image:
+            self.assertEqual(image.format, 'MPO')
+        return SimpleUploadedFile('phone.jpg', content, 'image/jpeg')
+
+    def test_mpo_photo_stored_as_jpeg(self):
+        """Снимок, который Pillow определяет как MPO, принимается и
+        хранится как JPEG."""
+        post = self.create_post(self.mpo())
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.format, 'JPEG')
+            self.assertEqual(stored.size, (30, 40))
+
+    def crafted_png(self, width, height):
+        """PNG 1x1, в заголовке которого записаны другие размеры: Pillow
+        прочитает их, не декодируя картинку."""
+        buffer = BytesIO()
+        Image.new('RGB', (1, 1)).save(buffer, 'PNG')
+        content = buffer.getvalue()
+        header = b'IHDR' + struct.pack('>II', width, height) + content[24:29]
+        crc = struct.pack('>I', zlib.crc32(header))
+        content = content[:12] + header + crc + content[33:]
+        return SimpleUploadedFile('bomb.png', content, 'image/png')
+
+    def assert_rejected(self, image):
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с бомбой', 'image': image},
+        )
+        self.assertFalse(Post.objects.filter(text='Пост с бомбой').exists())
+        self.assertTrue(response.context['form'].errors['image'])
+
+    def test_oversized_images_rejected_before_decoding(self):
+        """Картинки с огромными размерами в заголовке отклоняются без
+        декодирования."""
+        with mock.patch('posts.forms.ingest') as ingest:
+            self.assert_rejected(self.crafted_png(12001, 10))
+            self.assert_rejected(self.crafted_png(9000, 5000))
+        ingest.assert_not_called()
+
+    @override_settings(POST_IMAGE_MAX_UPLOAD_SIZE=10)
+    def test_large_file_rejected(self):
+        """Файл больше POST_IMAGE_MAX_UPLOAD_SIZE отклоняется."""
+        self.assert_rejected(self.upload('large.png', (60, 40), 'PNG'))
+
+    def test_truncated_jpeg_rejected(self):
+        """Обрезанный JPEG с целым заголовком отклоняется ошибкой формы,
+        а не падает при перекодировании."""
+        content = self.upload('truncated.jpg', (400, 300), 'JPEG').read()
+        self.assert_rejected(SimpleUploadedFile(
+            'truncated.jpg', content[:len(content) // 2], 'image/jpeg'))
@@ -1,7 +1,35 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import tempfile
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.conf import settings
+from django.urls import reverse
+
+from sorl.thumbnail.models import KVStore
+
+from ..models import Follow, Group, Post, User, UserCounter
+from ..thumbnails import backend, generate
 
-from ..models import Group, Post, User
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
 
 
 class PostModelTest(TestCase):
@@ -53,3 +81,225 @@ class PostModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     post._meta.get_field(field).help_text, expected_value)
+
+
+class UserCounterModelTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(username='reader')
+
+    def assert_counters(self, user, posts, followers, following):
+        counter = UserCounter.objects.get(user=user)
+        self.assertEqual(
+            (counter.posts_count, counter.followers_count,
+             counter.following_count),
+            (posts, followers, following),
+        )
+
+    def test_counters_follow_posts_and_subscriptions(self):
+        """Счётчики меняются при создании и удалении постов и подписок."""
+        post = Post.objects.create(author=self.author, text='Тестовый пост')
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        self.assert_counters(self.author, 1, 1, 0)
+        self.assert_counters(self.user, 0, 0, 1)
+        post.delete()
+        follow.delete()
+        self.assert_counters(self.author, 0, 0, 0)
+        self.assert_counters(self.user, 0, 0, 0)
+
+    def test_deleting_user_with_posts_and_follows(self):
+        """Удаление пользователя с постами и подписками не ломается на
+        счётчиках, а счётчики остальных уменьшаются."""
+        author = User.objects.create_user(username='leaving')
+        Post.objects.create(author=author, text='Тестовый пост')
+        Follow.objects.create(user=self.user, author=author)
+        Follow.objects.create(user=author, author=self.author)
+        author.delete()
+        self.assertFalse(UserCounter.objects.filter(user=author).exists())
+        self.assert_counters(self.author, 0, 0, 0)
+        self.assert_counters(self.user, 0, 0, 0)
+
+    def test_profile_without_counter_row(self):
+        """Профиль и страница поста пользователя без строки счётчиков
+        открываются, а строка создаётся с подсчитанными значениями."""
+        post = Post.objects.create(author=self.author, text='Тестовый пост')
+        UserCounter.objects.filter(user=self.author).delete()
+        urls = (
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:post_detail', args=[post.pk]),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(response, 'Всего постов')
+        self.assert_counters(self.author, 1, 0, 0)
+
+    def test_rebuild_counters_command(self):
+        """Команда rebuild_counters пересчитывает счётчики с нуля."""
+        Post.objects.create(author=self.author, text='Тестовый пост')
+        Follow.objects.create(user=self.user, author=self.author)
+        UserCounter.objects.all().delete()
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assert_counters(self.author, 1, 1, 0)
+        self.assert_counters(self.user, 0, 0, 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class PostImageMetadataTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, name):
+        return Post.objects.create(
+            author=self.author,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(name, SMALL_GIF, 'image/gif'),
+        )
+
+    def assert_metadata(self, post):
+        post.refresh_from_db()
+        self.assertEqual(
+            (post.image_width, post.image_height, post.image_size,
+             post.image_format, post.image_hash),
+            (2, 1, len(SMALL_GIF), 'GIF',
+             hashlib.sha256(SMALL_GIF).hexdigest()),
+        )
+
+    def test_metadata_filled_on_save(self):
+        """Сведения о картинке записываются при сохранении и сбрасываются
+        вместе с картинкой."""
+        post = self.create_post('metadata.gif')
+        self.assert_metadata(post)
+        post.image = None
+        post.save()
+        post.refresh_from_db()
+        self.assertIsNone(post.image_width)
+        self.assertEqual(post.image_hash, '')
+
+    def test_backfill_image_metadata_command(self):
+        """Команда backfill_image_metadata заполняет сведения у старых
+        постов и пропускает непрочитанные файлы."""
+        post = self.create_post('backfill.gif')
+        Post.objects.create(
+            author=self.author, text='Потерянный файл',
+            image='posts/missing.gif')
+        Post.objects.update(image_width=None, image_hash='')
+        out = StringIO()
+        call_command('backfill_image_metadata', chunk_size=1, stdout=out)
+        self.assert_metadata(post)
+        self.assertIn('не прочитано файлов: 1', out.getvalue())
+
+    def test_metadata_filled_by_migration(self):
+        """Миграция 0020 заполняет сведения о картинках старых постов и
+        пропускает непрочитанные файлы."""
+        post = self.create_post('migration.gif')
+        missing = Post.objects.create(
+            author=self.author, text='Потерянный файл',
+            image='posts/missing.gif')
+        Post.objects.update(image_width=None, image_hash='')
+        migration = import_module('posts.migrations.0020_fill_image_metadata')
+        migration.fill_image_metadata(apps, None)
+        self.assert_metadata(post)
+        missing.refresh_from_db()
+        self.assertIsNone(missing.image_width)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, POST_IMAGE_RELEASE_GRACE=0)
+@mock.patch('posts.signals.transaction.on_commit', lambda release: release())
+class PostImageStorageTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, name='shared.gif'):
+        return Post.objects.create(
+            author=self.author,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(name, SMALL_GIF, 'image/gif'),
+        )
+
+    def test_same_content_is_stored_once(self):
+        """Одинаковые загрузки хранятся одним файлом с именем по хешу."""
+        digest = hashlib.sha256(SMALL_GIF).hexdigest()
+        first = self.create_post('first.gif')
+        second = self.create_post('second.gif')
+        self.assertEqual(first.image.name, f'posts/{digest[:2]}/{digest}.gif')
+        self.assertEqual(first.image.name, second.image.name)
+
+    def test_file_deleted_with_last_reference(self):
+        """Файл удаляется только вместе с последним ссылающимся постом."""
+        first = self.create_post()
+        second = self.create_post()
+        storage = first.image.storage
+        first.delete()
+        self.assertTrue(storage.exists(second.image.name))
+        second.image = None
+        second.save()
+        self.assertFalse(storage.exists(first.image.name))
+
+    @override_settings(POST_IMAGE_RELEASE_GRACE=60)
+    def test_recently_saved_file_is_kept(self):
+        """Только что сохранённый файл не удаляется: его может ждать
+        ещё не записанный пост."""
+        post = self.create_post()
+        post.delete()
+        self.assertTrue(post.image.storage.exists(post.image.name))
+
+    def test_collect_orphaned_media_command(self):
+        """Команда удаляет файлы без ссылок из постов вместе с
+        миниатюрами и не трогает используемые."""
+        cache.clear()
+        post = self.create_post()
+        generate(post.image.name)
+        storage = post.image.storage
+        orphan = storage.save('posts/orphan.png', ContentFile(b'orphan'))
+        storage.write(orphan + '.webp', ContentFile(b'variant'))
+        stray = storage.save('cache/00/00/stray.jpg', ContentFile(b'stray'))
+        quarantine = tempfile.mkdtemp(dir=TEMP_MEDIA_ROOT)
+        out = StringIO()
+        call_command(
+            'collect_orphaned_media', chunk_size=1,
+            quarantine=quarantine, stdout=out,
+        )
+        self.assertIn('картинок: 2, миниатюр: 1', out.getvalue())
+        self.assertTrue(storage.exists(post.image.name))
+        for geometry, options in settings.POST_THUMBNAILS:
+            thumbnail = backend.get_existing(post.image, geometry, **options)
+            self.assertTrue(thumbnail.exists())
+        for name in (orphan, orphan + '.webp', stray):
+            self.assertFalse(storage.exists(name))
+        self.assertTrue(os.path.exists(os.path.join(quarantine, orphan)))
+
+    def test_collect_thumbnails_of_missing_images(self):
+        """Миниатюры картинки, на которую больше не ссылается ни один
+        пост и файла которой уже нет, удаляются вместе с записями sorl."""
+        cache.clear()
+        post = self.create_post('gone.gif')
+        generate(post.image.name)
+        thumbnails = [
+            backend.get_existing(post.image, geometry, **options)
+            for geometry, options in settings.POST_THUMBNAILS
+        ]
+        post.image.storage.delete(post.image.name)
+        Post.objects.filter(pk=post.pk).update(image='')
+        out = StringIO()
+        call_command('collect_orphaned_media', chunk_size=1, stdout=out)
+        self.assertIn(f'миниатюр: {len(thumbnails)}', out.getvalue())
+        for thumbnail in thumbnails:
+            self.assertFalse(thumbnail.exists())
+        self.assertFalse(KVStore.objects.exists())
@@ -0,0 +1,142 @@
+import re
+from importlib import import_module
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post, User
+from ..utils import encode_cursor
+
+# Полный проход по таблице без индекса или сортировка во временном B-дереве.
+# Проход по индексу (SCAN ... USING INDEX) — это чтение в нужном порядке,
+# а проход по подзапросу с LIMIT (у Django — «subquery») ограничен.
+BAD_PLAN = re.compile(
+    r'USE TEMP B-TREE|^SCAN (TABLE )?(?!subquery$)\w+( AS \w+)?$'
+)
+
+
+@override_settings(FEED_CELEBRITY_FOLLOWERS=2)
+class FeedQueryPlanTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.celebrity = User.objects.create_user(username='celebrity')
+        cls.user = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Описание тестовой группы',
+        )
+        Follow.objects.create(user=cls.user, author=cls.author)
+        Follow.objects.create(user=cls.user, author=cls.celebrity)
+        Follow.objects.create(user=cls.author, author=cls.celebrity)
+        for author in (cls.author, cls.celebrity) * settings.POSTS_PER_PAGE:
+            cls.post = Post.objects.create(
+                text='Тестовый текст',
+                author=author,
+                group=cls.group,
+            )
+        Comment.objects.create(
+            post=cls.post,
+            author=cls.user,
+            text='Тестовый комментарий',
+        )
+        Comment.objects.create(
+            post=cls.post,
+            author=cls.author,
+            text='@reader, посмотри',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(FeedQueryPlanTests.user)
+
+    def assert_query_plans_use_indexes(self, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, data)
+        self.assert_plans_use_indexes(queries.captured_queries, url=url)
+
+    def assert_plans_use_indexes(self, queries, **context):
+        with connection.cursor() as cursor:
+            for query in queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                for row in cursor.fetchall():
+                    with self.subTest(sql=query['sql'], **context):
+                        self.assertIsNone(BAD_PLAN.search(row[-1]), row[-1])
+
+    def feed_urls(self):
+        return (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+            reverse('posts:follow_index'),
+            reverse('posts:mention_index'),
+        )
+
+    def test_feed_queries_use_indexes(self):
+        """Запросы лент и страницы поста не сортируют во временном
+        B-дереве и не сканируют таблицы целиком."""
+        urls = self.feed_urls() + (
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+        )
+        for url in urls:
+            self.assert_query_plans_use_indexes(url)
+            self.assert_query_plans_use_indexes(url, {'page': 2})
+
+    @override_settings(POSTS_CURSOR_PAGINATION=True)
+    def test_cursor_feed_queries_use_indexes(self):
+        """Курсорные запросы лент идут по составным индексам."""
+        cursor = encode_cursor(self.post)
+        for url in self.feed_urls():
+            self.assert_query_plans_use_indexes(url)
+            self.assert_query_plans_use_indexes(url, {'after': cursor})
+            self.assert_query_plans_use_indexes(url, {'before': cursor})
+
+    def test_follower_queries_use_indexes(self):
+        """Подписчики для раскладки поста и возврата постов бывшего
+        популярного автора выбираются по индексу, без сортировки."""
+        with CaptureQueriesContext(connection) as queries:
+            Post.objects.create(text='Новый пост', author=self.author)
+            Follow.objects.filter(
+                user=self.author, author=self.celebrity).delete()
+        follower_queries = [
+            query for query in queries.captured_queries
+            if 'FROM "posts_follow"' in query['sql']
+        ]
+        self.assertTrue(follower_queries)
+        self.assert_plans_use_indexes(follower_queries)
+
+    def assert_full_text_not_loaded(self):
+        for url in self.feed_urls():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertContains(response, 'Тестовый текст')
+            for query in queries.captured_queries:
+                with self.subTest(url=url, sql=query['sql']):
+                    self.assertNotIn('"posts_post"."text"', query['sql'])
+                    self.assertNotIn('"posts_post"."text_html"', query['sql'])
+
+    def test_feeds_do_not_load_full_text(self):
+        """Ленты не читают полный текст постов, только начало."""
+        self.assert_full_text_not_loaded()
+
+    def test_empty_excerpts_filled_by_migration(self):
+        """Миграция 0021 готовит начало текста старых постов, и ленты с
+        ними не дочитывают полный текст по посту на карточку."""
+        Post.objects.update(excerpt_html='', is_truncated=True)
+        migration = import_module('posts.migrations.0021_fill_excerpts')
+        migration.fill_excerpts(apps, None)
+        self.assertFalse(Post.objects.filter(excerpt_html='').exists())
+        self.assertFalse(Post.objects.filter(is_truncated=True).exists())
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('posts:index'))
+        self.assertLess(len(queries), settings.POSTS_PER_PAGE)
+        self.assert_full_text_not_loaded()
@@ -0,0 +1,290 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail import default
+
+from ..caching import feed_version
+from ..models import Post, User
+from ..resize import cache_name, cull
+from ..storage import post_image_storage
+from ..thumbnails import backend, schedule, thumbnails_ready
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+def gif(name):
+    """Маленький GIF со своим цветом для каждого имени: одинаковое
+    содержимое хранилище сохранило бы в один общий файл."""
+    digest = hashlib.md5(name.encode()).digest()
+    buffer = BytesIO()
+    Image.new('RGB', (2, 1), color=tuple(digest[:3])).save(buffer, 'GIF')
+    return SimpleUploadedFile(name, buffer.getvalue(), 'image/gif')
+
+
+def is_ready(name):
+    return all(
+        backend.get_existing(name, geometry, **options)
+        for geometry, options in settings.POST_THUMBNAILS
+    )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailPipelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def upload(self, name):
+        return gif(name)
+
+    @override_settings(POST_THUMBNAIL_WORKERS=0)
+    def test_thumbnails_created_on_upload(self):
+        """Загрузка картинки через форму сразу создаёт её миниатюры."""
+        self.client.post(reverse('posts:post_create'), data={
+            'text': 'Пост с картинкой',
+            'image': self.upload('upload.gif'),
+        })
+        post = Post.objects.get(text='Пост с картинкой')
+        self.assertTrue(is_ready(post.image))
+
+    @override_settings(POST_THUMBNAIL_WORKERS=1)
+    def test_render_never_creates_thumbnails(self):
+        """Рендер ленты только читает миниатюры: недостающие ставятся в
+        очередь один раз, а карточка без миниатюры не кешируется."""
+        post = Post.objects.create(
+            text='Пост без миниатюры',
+            author=self.author,
+            image=self.upload('pending.gif'),
+        )
+        with mock.patch('posts.thumbnails.get_executor') as executor, \
+                mock.patch('posts.thumbnails.generate') as generate:
+            response = self.client.get(reverse('posts:index'))
+            self.client.get(reverse('posts:index'))
+        generate.assert_not_called()
+        executor.return_value.submit.assert_called_once()
+        self.assertNotContains(response, 'card-img')
+        self.assertFalse(is_ready(post.image))
+
+        with override_settings(POST_THUMBNAIL_WORKERS=0):
+            self.client.get(reverse('posts:post_detail', args=[post.pk]))
+        thumbnails_ready.send(sender=None, name=post.image.name)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'card-img')
+
+    @override_settings(POST_THUMBNAIL_WORKERS=0)
+    def test_responsive_image_variants(self):
+        """Все миниатюры создаются за одно декодирование исходника и
+        выводятся в srcset с размерами и ленивой загрузкой."""
+        post = Post.objects.create(
+            text='Пост с картинкой',
+            author=self.author,
+            image=self.upload('responsive.gif'),
+        )
+        with mock.patch.object(
+            default.engine, 'get_image', wraps=default.engine.get_image
+        ) as get_image:
+            response = self.client.get(
+                reverse('posts:post_detail', args=[post.pk]))
+        get_image.assert_called_once()
+        self.assertContains(response, 'width="960" height="339"')
+        self.assertContains(response, 'loading="lazy"')
+        for geometry, options in settings.POST_THUMBNAILS:
+            width = geometry.split('x')[0]
+            self.assertContains(response, f' {width}w')
+
+    @override_settings(POST_THUMBNAIL_WORKERS=0)
+    def test_duplicate_uploads_share_file_and_thumbnails(self):
+        """Повторная загрузка того же содержимого ссылается на тот же файл и
+        сразу получает его миниатюры."""
+        first = Post.objects.create(
+            text='Первый', author=self.author, image=self.upload('meme.gif'))
+        self.client.get(reverse('posts:post_detail', args=[first.pk]))
+        second = Post.objects.create(
+            text='Второй', author=self.author, image=self.upload('meme.gif'))
+        self.assertEqual(first.image.name, second.image.name)
+        with mock.patch.object(default.engine, 'get_image') as get_image:
+            self.assertTrue(is_ready(second.image))
+        get_image.assert_not_called()
+
+    @override_settings(POST_THUMBNAIL_WORKERS=0)
+    def test_image_without_metadata_rendered_as_is(self):
+        """Картинка без сведений о ней выводится по исходному адресу, без
+        декодирования и миниатюр."""
+        post = Post.objects.create(
+            text='Старый пост',
+            author=self.author,
+            image=self.upload('legacy.gif'),
+        )
+        Post.objects.filter(pk=post.pk).update(image_format='')
+        with mock.patch.object(default.engine, 'get_image') as get_image:
+            response = self.client.get(
+                reverse('posts:post_detail', args=[post.pk]))
+        get_image.assert_not_called()
+        self.assertContains(response, f'src="{post.image.url}"')
+
+    def test_ready_signal_bumps_feeds(self):
+        """Готовность миниатюр сбрасывает кеш лент с этим постом."""
+        post = Post.objects.create(
+            text='Пост',
+            author=self.author,
+            image=self.upload('signal.gif'),
+        )
+        version = feed_version('index')
+        thumbnails_ready.send(sender=None, name=post.image.name)
+        self.assertNotEqual(feed_version('index'), version)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, POST_THUMBNAIL_WORKERS=0)
+class ThumbnailPrefetchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        for number in range(3):
+            post = Post.objects.create(
+                text=f'Пост {number}',
+                author=cls.author,
+                image=gif(f'prefetch_{number}.gif'),
+            )
+            schedule(post.image.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def render_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'card-img', count=3)
+        return [
+            query['sql'] for query in queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+
+    def test_page_thumbnails_resolved_in_one_lookup(self):
+        """Миниатюры всех постов страницы читаются одним get_many, а при
+        холодном кеше — одним запросом к базе."""
+        cache.clear()
+        self.assertEqual(len(self.render_index()), 1)
+        for post in Post.objects.all():
+            post.save()
+        with mock.patch.object(
+            default.kvstore.cache, 'get', wraps=default.kvstore.cache.get
+        ) as get:
+            self.assertEqual(self.render_index(), [])
+        thumbnail_gets = [
+            call for call in get.call_args_list
+            if 'thumbnail' in str(call)
+        ]
+        self.assertEqual(thumbnail_gets, [])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, MEDIA_SENDFILE=None)
+class ResizeEndpointTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        buffer = BytesIO()
+        Image.new('RGB', (400, 200), color='red').save(buffer, 'PNG')
+        cls.name = post_image_storage.save(
+            'posts/resize.png', ContentFile(buffer.getvalue()))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def resized_url(self, *args, name=None):
+        tag = ' '.join(['resized_url', 'image', *args])
+        template = Template('{% load post_thumbnails %}{% ' + tag + ' %}')
+        return template.render(Context({
+            'image': SimpleNamespace(name=name or self.name)}))
+
+    def fetch(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return Image.open(BytesIO(b''.join(response.streaming_content)))
+
+    def test_variant_created_once(self):
+        """Вариант создаётся по первому запросу и дальше отдаётся с диска
+        с долгим кешированием."""
+        url = self.resized_url('100')
+        self.assertEqual(self.fetch(url).size, (100, 50))
+        with mock.patch('posts.resize._render') as render:
+            response = self.client.get(url)
+        render.assert_not_called()
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(
+            self.fetch(self.resized_url('50', '50', 'crop=True')).size,
+            (50, 50),
+        )
+
+    def test_invalid_requests(self):
+        """Чужая подпись, неверная геометрия и отсутствующий исходник —
+        404."""
+        url = self.resized_url('100')
+        for bad_url in (
+            url.replace('/100x0/', '/200x0/'),
+            self.resized_url('5000'),
+            self.resized_url('100', '0', 'crop=True'),
+            self.resized_url('100', name='posts/missing.png'),
+        ):
+            with self.subTest(url=bad_url):
+                self.assertEqual(self.client.get(bad_url).status_code, 404)
+
+    def test_cull_removes_least_recently_used(self):
+        """Команда cull_resized_images удаляет давно не читавшиеся
+        варианты сверх RESIZE_CACHE_MAX_SIZE; запросы кеш не чистят."""
+        for width in (10, 20, 30):
+            self.fetch(self.resized_url(str(width)))
+        paths = [
+            os.path.join(TEMP_MEDIA_ROOT, cache_name(self.name, f'{w}x0'))
+            for w in (10, 20, 30)
+        ]
+        for age, path in enumerate(paths):
+            os.utime(path, (1000 * age, 1000 * age))
+        out = StringIO()
+        with override_settings(
+            RESIZE_CACHE_MAX_SIZE=os.path.getsize(paths[2])
+        ):
+            with mock.patch('posts.resize.cull', wraps=cull) as resize_cull:
+                self.fetch(self.resized_url('40'))
+            resize_cull.assert_not_called()
+            newest = os.path.join(
+                TEMP_MEDIA_ROOT, cache_name(self.name, '40x0'))
+            os.utime(newest, (1500, 1500))
+            call_command('cull_resized_images', stdout=out)
+        self.assertIn('Удалено вариантов картинок: 3', out.getvalue())
+        self.assertEqual([os.path.exists(path) for path in paths],
+                         [False, False, True])
@@ -1,14 +1,33 @@
 import shutil
 import tempfile
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+from urllib.parse import quote
 
-from django.test import Client, TestCase, override_settings
+from django.apps import apps
+from django.test import Client, RequestFactory, TestCase, override_settings
 from django.urls import reverse
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from ..models import Group, Post, User, Follow
+from ..caching import feed_version_key
+from ..feeds import MentionFeed, TagFeed
+from ..models import (
+    Comment, Follow, Group, Mention, MentionedPost, Post, PostTag, Tag,
+    TagActivity, TimelineEntry, User
+)
+from ..markup import excerpt, render_text
+from ..mentions import extract_mentions
+from ..tags import current_hour, extract_tags, trending_tags
 from ..forms import PostForm
+from ..templatetags.post_cards import card_key
+from ..utils import encode_cursor, paginator
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -160,18 +179,64 @@ class PostViewTests(TestCase):
         self.assertNotIn(post, response.context['page_obj'].object_list)
 
     def test_cache_index_page_context(self):
-        """Проверка работы кеша страницы index.html."""
+        """Фрагмент index.html отдаётся из кеша, пока лента не изменилась,
+        и сбрасывается при появлении нового поста."""
         response_cached = self.authorized_client.get('/')
+        Post.objects.filter(pk=PostViewTests.post.pk).update(
+            text='Изменён в обход сигналов')
+        response = self.authorized_client.get('/')
+        self.assertEqual(response_cached.content, response.content)
         Post.objects.create(
-            text='Не должен кешироваться',
+            text='Новый пост без задержки',
             author=PostViewTests.author,
             group=PostViewTests.group,
         )
         response = self.authorized_client.get('/')
-        self.assertEqual(response_cached.content, response.content)
-        cache.clear()
-        response = self.authorized_client.get('/')
         self.assertNotEqual(response_cached.content, response.content)
+        self.assertContains(response, 'Новый пост без задержки')
+
+    def test_cache_group_and_profile_pages_follow_post_edit(self):
+        """Перенос поста в другую группу сбрасывает кеш обеих групп и
+        профиля автора."""
+        post = Post.objects.create(
+            text='Пост для переноса',
+            author=PostViewTests.author,
+            group=PostViewTests.group,
+        )
+        old_group_url = reverse(
+            'posts:group_list', kwargs={'slug': PostViewTests.group.slug})
+        new_group_url = reverse(
+            'posts:group_list',
+            kwargs={'slug': PostViewTests.other_group.slug})
+        profile_url = reverse('posts:profile', kwargs={'username': 'author'})
+        for url in (old_group_url, new_group_url, profile_url):
+            self.authorized_client.get(url)
+        post.group = PostViewTests.other_group
+        post.save()
+        self.assertNotContains(
+            self.authorized_client.get(old_group_url), post.text)
+        self.assertContains(
+            self.authorized_client.get(new_group_url), post.text)
+        self.assertContains(
+            self.authorized_client.get(profile_url),
+            f'все записи группы {PostViewTests.other_group.title}')
+
+    def test_post_cards_are_shared_between_feeds(self):
+        """Карточка поста, отрендеренная на главной, переиспользуется в
+        ленте подписок и перерисовывается после изменения поста."""
+        Follow.objects.create(user=self.user, author=PostViewTests.author)
+        self.authorized_client.get(reverse('posts:index'))
+        Post.objects.filter(pk=PostViewTests.post.pk).update(
+            text='Изменён в обход сигналов')
+        response = self.authorized_client_follower.get(
+            reverse('posts:follow_index'))
+        self.assertContains(response, PostViewTests.post.text)
+        post = Post.objects.get(pk=PostViewTests.post.pk)
+        post.text = 'Изменён через форму'
+        post.save()
+        response = self.authorized_client_follower.get(
+            reverse('posts:follow_index'))
+        self.assertContains(response, 'Изменён через форму')
 
     def test_cache_index_page_context_for_different_users(self):
         """Проверка работы кеша страницы index.html для разных
@@ -234,6 +299,62 @@ class PostViewTests(TestCase):
             reverse('posts:follow_index'))
         self.assertNotIn(follow_post, response.context['page_obj'].object_list)
 
+    def test_follow_timeline_filled_on_post_and_pruned_on_unfollow(self):
+        """Новый пост попадает в материализованную ленту подписчика, а
+        после отписки посты автора из неё удаляются."""
+        self.authorized_client_follower.get(reverse(
+            'posts:profile_follow',
+            kwargs={'username': 'author'})
+        )
+        new_post = Post.objects.create(
+            text='Пост после подписки',
+            author=PostViewTests.author,
+        )
+        self.assertTrue(
+            self.user.timeline.filter(post=new_post).exists())
+        response = self.authorized_client_follower.get(
+            reverse('posts:follow_index'))
+        self.assertEqual(new_post, response.context['page_obj'][0])
+        self.authorized_client_follower.get(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': 'author'})
+        )
+        self.assertFalse(self.user.timeline.exists())
+
+    @override_settings(FOLLOW_TIMELINE_LENGTH=2)
+    def test_trim_timelines_keeps_latest_entries(self):
+        """trim_timelines обрезает ленту подписчика до
+        FOLLOW_TIMELINE_LENGTH последних записей."""
+        Follow.objects.create(user=self.user, author=PostViewTests.author)
+        posts = [
+            Post.objects.create(text=f'Пост {i}', author=PostViewTests.author)
+            for i in range(4)
+        ]
+        self.assertEqual(self.user.timeline.count(), 5)
+        call_command('trim_timelines', chunk_size=1, stdout=StringIO())
+        self.assertEqual(
+            list(self.user.timeline.values_list('post', flat=True)),
+            [posts[3].pk, posts[2].pk],
+        )
+
+    def test_profile_and_post_detail_render_without_counts(self):
+        """Профиль и страница поста берут счётчики из UserCounter без
+        COUNT-запросов."""
+        urls = (
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail',
+                    kwargs={'post_id': PostViewTests.post.id}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.authorized_client.get(url)
+                self.assertContains(response, 'Всего постов')
+                self.assertFalse([
+                    query['sql'] for query in queries.captured_queries
+                    if 'COUNT(' in query['sql']
+                ])
+
 
 class PaginatorViewsTest(TestCase):
     @classmethod
@@ -272,3 +393,786 @@ class PaginatorViewsTest(TestCase):
                     settings.POSTS_COUNT_FOR_PAGINATOR
                     - settings.POSTS_PER_PAGE
                 )
+
+
+@override_settings(POSTS_CURSOR_PAGINATION=True)
+class CursorPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Описание тестовой группы',
+        )
+        for _ in range(settings.POSTS_COUNT_FOR_PAGINATOR):
+            Post.objects.create(
+                text='Тестовый текст',
+                author=cls.author,
+                group=cls.group,
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cursor_pages_walk_through_feeds(self):
+        """Курсорная навигация листает ленты вперёд и назад без
+        пропусков и повторов."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                first_page = self.client.get(url).context['page_obj']
+                self.assertEqual(len(first_page), settings.POSTS_PER_PAGE)
+                self.assertFalse(first_page.has_previous())
+                second_page = self.client.get(
+                    url, {'after': first_page.next_cursor}
+                ).context['page_obj']
+                self.assertEqual(
+                    len(second_page),
+                    settings.POSTS_COUNT_FOR_PAGINATOR
+                    - settings.POSTS_PER_PAGE
+                )
+                self.assertFalse(second_page.has_next())
+                self.assertFalse(
+                    set(first_page.object_list)
+                    & set(second_page.object_list)
+                )
+                previous_page = self.client.get(
+                    url, {'before': second_page.previous_cursor}
+                ).context['page_obj']
+                self.assertEqual(
+                    previous_page.object_list, first_page.object_list)
+
+    def test_cursor_page_does_not_count(self):
+        """Курсорная страница не выполняет COUNT по ленте."""
+        post = Post.objects.order_by('-pub_date', '-pk')[5]
+        with self.assertNumQueries(1):
+            page_obj = paginator(
+                RequestFactory().get('/', {'after': encode_cursor(post)}),
+                Post.objects.all(),
+            )
+        self.assertEqual(len(page_obj), settings.POSTS_PER_PAGE - 4)
+
+    def test_broken_cursor_opens_first_page(self):
+        """Испорченный токен открывает первую страницу ленты."""
+        response = self.client.get(reverse('posts:index'), {'after': '%%%'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(response.context['page_obj']), settings.POSTS_PER_PAGE)
+
+
+@override_settings(FEED_CELEBRITY_FOLLOWERS=2)
+class HybridFeedViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.celebrity = User.objects.create_user(username='celebrity')
+        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(username='reader')
+        cls.other_user = User.objects.create_user(username='other_reader')
+        Follow.objects.create(user=cls.other_user, author=cls.celebrity)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(HybridFeedViewsTest.user)
+        self.client.get(reverse(
+            'posts:profile_follow', kwargs={'username': 'celebrity'}))
+        self.client.get(reverse(
+            'posts:profile_follow', kwargs={'username': 'author'}))
+        self.posts = [
+            Post.objects.create(text=f'Пост {i}', author=author)
+            for i, author in enumerate(
+                (self.celebrity, self.author) * settings.POSTS_PER_PAGE)
+        ]
+
+    def test_celebrity_posts_are_pulled_not_pushed(self):
+        """Посты популярного автора не раскладываются по лентам, но
+        попадают в ленту подписок при чтении в порядке публикации."""
+        self.assertFalse(
+            self.user.timeline.filter(post__author=self.celebrity).exists())
+        self.assertTrue(
+            self.user.timeline.filter(post__author=self.author).exists())
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']),
+            self.posts[::-1][:settings.POSTS_PER_PAGE],
+        )
+        self.assertEqual(
+            response.context['page_obj'].paginator.count, len(self.posts))
+
+    def test_hybrid_feed_counts_duplicates_once(self):
+        """Пост популярного автора, попавший в ленту до перехода порога,
+        считается один раз, и последняя страница не пустая."""
+        post = self.posts[0]
+        TimelineEntry.objects.create(
+            user=self.user, post=post, pub_date=post.pub_date)
+        response = self.client.get(
+            reverse('posts:follow_index'), {'page': 2})
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj.paginator.count, len(self.posts))
+        self.assertEqual(
+            list(page_obj), self.posts[::-1][settings.POSTS_PER_PAGE:])
+
+    def test_hybrid_feed_pages_limited_by_timeline_length(self):
+        """Постраничная лента подписок не глубже FOLLOW_TIMELINE_LENGTH
+        постов."""
+        with override_settings(FOLLOW_TIMELINE_LENGTH=settings.POSTS_PER_PAGE):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(
+                    reverse('posts:follow_index'), {'page': 2})
+        page_obj = response.context['page_obj']
+        count_sql = next(
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT COUNT'))
+        self.assertIn(f'LIMIT {settings.POSTS_PER_PAGE}', count_sql)
+        self.assertEqual(page_obj.paginator.count, settings.POSTS_PER_PAGE)
+        self.assertEqual(
+            list(page_obj), self.posts[::-1][:settings.POSTS_PER_PAGE])
+
+    def test_celebrity_posts_backfilled_below_threshold(self):
+        """Когда у автора становится меньше FEED_CELEBRITY_FOLLOWERS
+        подписчиков, его посты раскладываются по лентам оставшихся."""
+        Follow.objects.get(
+            user=self.other_user, author=self.celebrity).delete()
+        self.assertEqual(
+            set(self.user.timeline.filter(
+                post__author=self.celebrity).values_list('post', flat=True)),
+            {post.pk for post in self.posts[::2]},
+        )
+        Post.objects.create(text='Новый пост', author=self.celebrity)
+        self.assertEqual(
+            self.user.timeline.filter(post__author=self.celebrity).count(),
+            len(self.posts[::2]) + 1,
+        )
+
+    @override_settings(POSTS_CURSOR_PAGINATION=True)
+    def test_hybrid_feed_cursor_pages(self):
+        """Курсорная навигация по смешанной ленте подписок."""
+        url = reverse('posts:follow_index')
+        first_page = self.client.get(url).context['page_obj']
+        second_page = self.client.get(
+            url, {'after': first_page.next_cursor}).context['page_obj']
+        self.assertEqual(
+            list(first_page) + list(second_page), self.posts[::-1])
+
+
+@override_settings(ANONYMOUS_PAGE_CACHE=True)
+class AnonymousPageCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Описание тестовой группы',
+        )
+        cls.post = Post.objects.create(
+            text='Тестовый текст',
+            author=cls.author,
+            group=cls.group,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_served_from_cache_without_queries(self):
+        """Повторный анонимный запрос отдаётся из кеша без запросов к
+        базе данных."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                with self.assertNumQueries(0):
+                    cached_response = self.client.get(url)
+                self.assertEqual(response.content, cached_response.content)
+
+    def test_new_post_and_comment_purge_their_pages(self):
+        """Новый пост сбрасывает главную, страницу группы и профиль автора,
+        новый комментарий — страницу поста."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+        )
+        for url in urls:
+            self.client.get(url)
+        Post.objects.create(
+            text='Свежий пост', author=self.author, group=self.group)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), 'Свежий пост')
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        self.client.get(url)
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Свежий комментарий')
+        self.assertContains(self.client.get(url), 'Свежий комментарий')
+        # Страница поста сбрасывается по пути; отдельного поколения у
+        # поста нет.
+        self.assertIsNone(cache.get(feed_version_key('post', self.post.id)))
+
+    def test_group_rename_purges_author_profiles_in_one_query(self):
+        """Переименование группы сбрасывает профили всех её авторов, а
+        имена авторов читаются одним запросом."""
+        authors = [self.author] + [
+            User.objects.create_user(username=f'author{number}')
+            for number in range(3)
+        ]
+        for author in authors[1:]:
+            Post.objects.create(
+                text='Пост в группе', author=author, group=self.group)
+        urls = [
+            reverse('posts:profile', kwargs={'username': author.username})
+            for author in authors
+        ]
+        for url in urls:
+            self.client.get(url)
+        self.group.title = 'Новое название'
+        with CaptureQueriesContext(connection) as queries:
+            self.group.save()
+        self.assertEqual(
+            sum('"auth_user"' in query['sql'] for query in queries), 1)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(
+                    self.client.get(url), 'все записи группы Новое название')
+
+    def test_authorized_pages_are_not_cached(self):
+        """Авторизованные пользователи получают страницы мимо кеша."""
+        self.client.force_login(self.author)
+        self.client.get(reverse('posts:index'))
+        response = self.client.get(reverse('posts:index'))
+        self.assertIsNotNone(response.context)
+
+
+class SearchViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(
+            text='Сегодня ходили в горы и видели облака',
+            author=cls.author,
+        )
+        for number in range(settings.POSTS_COUNT_FOR_PAGINATOR):
+            Post.objects.create(
+                text=f'Горный поход номер {number}', author=cls.author)
+
+    def search(self, query, **params):
+        return self.client.get(
+            reverse('posts:search'), {'q': query, **params}
+        ).context['page_obj']
+
+    def test_search_finds_ranked_posts(self):
+        """Поиск находит посты по словам и префиксу без учёта регистра."""
+        self.assertEqual(list(self.search('ГОРЫ облака')), [self.post])
+        self.assertEqual(list(self.search('обла')), [self.post])
+        self.assertEqual(list(self.search('пустыня')), [])
+        for query in ('', '"', 'NEAR(горы', '*'):
+            with self.subTest(query=query):
+                self.assertEqual(list(self.search(query)), [])
+
+    def test_index_follows_post_changes(self):
+        """Индекс обновляется при правке и удалении постов."""
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Теперь про море'
+        post.save()
+        self.assertEqual(list(self.search('облака')), [])
+        self.assertEqual(list(self.search('море')), [post])
+        post.delete()
+        self.assertEqual(list(self.search('море')), [])
+
+    def test_rebuild_search_index_command(self):
+        """Команда восстанавливает индекс по таблице постов."""
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_post_fts')
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(list(self.search('облака')), [self.post])
+
+    def test_search_cursor_pages(self):
+        """Выдача листается курсорами без повторов и пропусков."""
+        first_page = self.search('горный')
+        self.assertEqual(len(first_page), settings.POSTS_PER_PAGE)
+        second_page = self.search('горный', after=first_page.next_cursor)
+        self.assertEqual(
+            len(second_page),
+            settings.POSTS_COUNT_FOR_PAGINATOR - settings.POSTS_PER_PAGE,
+        )
+        self.assertFalse(second_page.has_next())
+        self.assertFalse(
+            set(first_page.object_list) & set(second_page.object_list))
+        previous_page = self.search(
+            'горный', before=second_page.previous_cursor)
+        self.assertEqual(previous_page.object_list, first_page.object_list)
+
+    def test_search_in_comments(self):
+        """С in=comments поиск идёт по комментариям и ведёт к их постам,
+        а курсоры страниц сохраняют область поиска."""
+        comment = Comment.objects.create(
+            post=self.post, author=self.author, text='Облака над горами')
+        for number in range(settings.POSTS_PER_PAGE):
+            Comment.objects.create(
+                post=self.post, author=self.author, text=f'Облака {number}')
+        in_comments = {'in': 'comments'}
+        self.assertEqual(list(self.search('пустыня', **in_comments)), [])
+        self.assertNotIn(comment, self.search('горами'))
+        response = self.client.get(
+            reverse('posts:search'), {'q': 'горами', **in_comments})
+        self.assertEqual(list(response.context['page_obj']), [comment])
+        self.assertContains(
+            response, reverse('posts:post_detail', args=[self.post.pk]))
+        page = self.search('облака', **in_comments)
+        self.assertEqual(len(page), settings.POSTS_PER_PAGE)
+        response = self.client.get(
+            reverse('posts:search'), {'q': 'облака', **in_comments})
+        self.assertContains(
+            response, f'q={quote("облака")}&amp;in=comments')
+        comment.delete()
+        self.assertEqual(list(self.search('горами', **in_comments)), [])
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке постов и комментариев идёт по индексу."""
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Красивые облака')
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        for url in (
+            reverse('admin:posts_post_changelist'),
+            reverse('admin:posts_comment_changelist'),
+        ):
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, {'q': 'облака'})
+                self.assertEqual(response.context['cl'].result_count, 1)
+                self.assertFalse(any(
+                    'LIKE' in query['sql'] for query in queries))
+
+
+class TagFeedViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        for number in range(settings.POSTS_COUNT_FOR_PAGINATOR):
+            Post.objects.create(
+                text=f'Поход {number} #Горы', author=cls.author)
+        cls.post = Post.objects.create(
+            text='#горы и #Море, #1, a#b, #горы', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_tags_parsed_on_save(self):
+        """Теги разбираются из текста, нормализуются и считаются."""
+        self.assertEqual(
+            sorted(self.post.post_tags.values_list('tag__name', flat=True)),
+            ['горы', 'море'],
+        )
+        self.assertEqual(
+            Tag.objects.get(name='горы').posts_count,
+            settings.POSTS_COUNT_FOR_PAGINATOR + 1,
+        )
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Только #море'
+        post.save()
+        self.assertEqual(
+            Tag.objects.get(name='горы').posts_count,
+            settings.POSTS_COUNT_FOR_PAGINATOR,
+        )
+        post.delete()
+        self.assertEqual(Tag.objects.get(name='море').posts_count, 0)
+
+    def test_rebuild_tags_command(self):
+        """Команда восстанавливает связи и счётчики тегов."""
+        PostTag.objects.all().delete()
+        Tag.objects.update(posts_count=0)
+        call_command('rebuild_tags', stdout=StringIO())
+        self.assertEqual(Tag.objects.get(name='море').posts_count, 1)
+        self.assertEqual(
+            PostTag.objects.filter(tag__name='горы').count(),
+            settings.POSTS_COUNT_FOR_PAGINATOR + 1,
+        )
+
+    def test_tag_page(self):
+        """Лента тега открывается без учёта регистра, листается и
+        выводит теги постов ссылками."""
+        url = reverse('posts:tag_posts', args=['ГОРЫ'])
+        response = self.client.get(url)
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj[0], self.post)
+        self.assertEqual(
+            page_obj.paginator.count, settings.POSTS_COUNT_FOR_PAGINATOR + 1)
+        self.assertContains(
+            response, f'href="{reverse("posts:tag_posts", args=["море"])}"')
+        second_page = self.client.get(url, {'page': 2}).context['page_obj']
+        self.assertEqual(
+            len(second_page),
+            settings.POSTS_COUNT_FOR_PAGINATOR + 1 - settings.POSTS_PER_PAGE,
+        )
+        missing = reverse('posts:tag_posts', args=['пустыня'])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+    @override_settings(POSTS_CURSOR_PAGINATION=True)
+    def test_tag_cursor_pages(self):
+        """Лента тега листается курсорами без повторов."""
+        url = reverse('posts:tag_posts', args=['горы'])
+        first_page = self.client.get(url).context['page_obj']
+        second_page = self.client.get(
+            url, {'after': first_page.next_cursor}).context['page_obj']
+        self.assertEqual(
+            len(first_page) + len(second_page),
+            settings.POSTS_COUNT_FOR_PAGINATOR + 1,
+        )
+        self.assertFalse(
+            set(first_page.object_list) & set(second_page.object_list))
+
+    def test_tag_feed_uses_index(self):
+        """Страница тега читается по индексу связей, без LIKE."""
+        tag = Tag.objects.get(name='горы')
+        entries = TagFeed(tag).entries[:settings.POSTS_PER_PAGE]
+        with connection.cursor() as cursor:
+            sql, params = entries.query.sql_with_params()
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('post_tag_pub_date_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('posts:tag_posts', args=['горы']))
+        self.assertFalse(any('LIKE' in query['sql'] for query in queries))
+
+    def test_trending_tags(self):
+        """Популярные теги упорядочены по числу постов за окно."""
+        Post.objects.create(text='#море', author=self.author)
+        Post.objects.create(text='#море', author=self.author)
+        self.assertEqual(
+            [tag.name for tag in trending_tags()], ['горы', 'море'])
+        TagActivity.objects.update(
+            hour=current_hour() - timedelta(
+                hours=settings.TAG_TRENDING_HOURS + 1))
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(trending_tags(), [])
+        self.assertFalse(any(
+            query['sql'].startswith('DELETE') for query in queries))
+        out = StringIO()
+        call_command('prune_tag_activity', stdout=out)
+        self.assertIn('Удалено счётчиков тегов: 2', out.getvalue())
+        self.assertFalse(TagActivity.objects.exists())
+
+    def test_url_fragments_are_not_tags(self):
+        """#фрагмент и /@имя внутри ссылки не становятся тегом или
+        упоминанием и не превращаются в ссылки сайта."""
+        text = (
+            'Читайте https://example.com/docs#install и '
+            'example.com/#news, а ещё www.example.com/@author #море'
+        )
+        self.assertEqual(extract_tags(text), ['море'])
+        self.assertEqual(extract_mentions(text), [])
+        html = render_text(text, users={'author'})
+        self.assertIn('https://example.com/docs#install', html)
+        self.assertIn('example.com/#news', html)
+        self.assertNotIn(
+            reverse('posts:tag_posts', args=['install']), html)
+        self.assertNotIn(reverse('posts:profile', args=['author']), html)
+        self.assertIn(reverse('posts:tag_posts', args=['море']), html)
+
+
+class MentionTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.bob = User.objects.create_user(username='bob')
+        cls.alice = User.objects.create_user(username='alice.k')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_mentions_resolved_in_one_query(self):
+        """Все упоминания текста находятся одним запросом и сохраняются
+        записями и ссылками в text_html."""
+        with CaptureQueriesContext(connection) as queries:
+            post = Post.objects.create(
+                text='@bob и @alice.k, @ghost, bob@example.com, @author.',
+                author=self.author,
+            )
+        user_queries = [
+            query for query in queries
+            if '"auth_user"."username" IN' in query['sql']
+        ]
+        self.assertEqual(len(user_queries), 1)
+        self.assertEqual(
+            set(post.mentions.values_list('user__username', flat=True)),
+            {'bob', 'alice.k'},
+        )
+        profile = reverse('posts:profile', args=['alice.k'])
+        self.assertIn(f'<a href="{profile}">@alice.k</a>,', post.text_html)
+        self.assertIn('@ghost', post.text_html)
+        self.assertNotIn(reverse('posts:profile', args=['ghost']),
+                         post.text_html)
+        self.assertIn('bob@example.com', post.text_html)
+        post.text = 'Без упоминаний'
+        post.save()
+        self.assertFalse(post.mentions.exists())
+
+    def test_mention_feed(self):
+        """Лента упоминаний показывает посты и комментарии с
+        упоминанием пользователя, по одной карточке на пост."""
+        post = Post.objects.create(text='Привет, @bob', author=self.author)
+        other = Post.objects.create(text='Просто пост', author=self.author)
+        Comment.objects.create(
+            post=other, author=self.alice, text='@bob, посмотри')
+        Comment.objects.create(
+            post=post, author=self.alice, text='И я зову @bob')
+        Comment.objects.create(
+            post=other, author=self.alice, text='@bob, ещё раз')
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('posts:mention_index'))
+        posts = list(response.context['page_obj'])
+        self.assertEqual(posts, [other, post])
+        self.assertEqual(
+            [comment.text for comment in posts[0].mention_comments],
+            ['@bob, посмотри', '@bob, ещё раз'],
+        )
+        self.assertEqual(posts[0].mention_comments[0].author, self.alice)
+        self.assertContains(response, 'посмотри')
+        self.assertContains(response, 'Просто пост', count=1)
+        with connection.cursor() as cursor:
+            sql, params = MentionFeed(self.bob).entries[
+                :10].query.sql_with_params()
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('mentioned_post_user_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_mention_feed_follows_comment_changes(self):
+        """Пост поднимается в ленте упоминаний новым комментарием и
+        уходит из неё, когда удалены все упоминания."""
+        post = Post.objects.create(text='Привет, @bob', author=self.author)
+        other = Post.objects.create(text='Просто пост', author=self.author)
+        comment = Comment.objects.create(
+            post=other, author=self.alice, text='@bob, посмотри')
+        feed = MentionFeed(self.bob)
+        self.assertEqual(feed[0:10], [other, post])
+        self.assertEqual(feed.count(), 2)
+        comment.delete()
+        self.assertEqual(feed[0:10], [post])
+        post.text = 'Уже без упоминаний'
+        post.save()
+        self.assertEqual(feed.count(), 0)
+        Comment.objects.create(
+            post=post, author=self.alice, text='Но @bob всё ещё тут')
+        self.assertEqual(feed[0:10], [post])
+        post.delete()
+        self.assertEqual(feed.count(), 0)
+
+    @override_settings(POSTS_CURSOR_PAGINATION=True)
+    def test_mention_feed_cursor_pages(self):
+        """Лента упоминаний листается курсорами по времени последнего
+        упоминания без повторов постов."""
+        posts = [
+            Post.objects.create(
+                text=f'@bob, пост {number}', author=self.author)
+            for number in range(settings.POSTS_PER_PAGE + 1)
+        ]
+        Comment.objects.create(
+            post=posts[0], author=self.alice, text='Снова @bob')
+        self.client.force_login(self.bob)
+        url = reverse('posts:mention_index')
+        first_page = self.client.get(url).context['page_obj']
+        self.assertEqual(first_page[0], posts[0])
+        second_page = self.client.get(
+            url, {'after': first_page.next_cursor}).context['page_obj']
+        self.assertEqual(
+            len(first_page) + len(second_page), len(posts))
+        self.assertFalse(
+            set(first_page.object_list) & set(second_page.object_list))
+
+    def test_mention_feed_uses_post_cards(self):
+        """Карточки ленты упоминаний кешируются так же, как в других
+        лентах."""
+        post = Post.objects.create(text='Привет, @bob', author=self.author)
+        self.client.force_login(self.bob)
+        self.client.get(reverse('posts:mention_index'))
+        post = Post.objects.select_related('author', 'group').get(pk=post.pk)
+        self.assertIsNotNone(cache.get(card_key(post, True, True)))
+
+    def test_render_text_html_backfills_mentions(self):
+        """Команда render_text_html записывает упоминания старых постов и
+        комментариев."""
+        post = Post.objects.create(text='Привет, @bob', author=self.author)
+        comment = Comment.objects.create(
+            post=post, author=self.alice, text='@bob и @author')
+        Mention.objects.all().delete()
+        call_command('render_text_html', chunk_size=1, stdout=StringIO())
+        self.assertEqual(
+            set(Mention.objects.values_list(
+                'user__username', 'post', 'comment', 'pub_date')),
+            {
+                ('bob', post.pk, None, post.pub_date),
+                ('bob', post.pk, comment.pk, comment.created),
+                ('author', post.pk, comment.pk, comment.created),
+            },
+        )
+        self.assert_mentioned_posts(
+            {('bob', post.pk, comment.created),
+             ('author', post.pk, comment.created)})
+
+    def test_mentioned_posts_filled_by_migration(self):
+        """Миграция 0022 собирает ленты упоминаний из упоминаний."""
+        post = Post.objects.create(text='Привет, @bob', author=self.author)
+        comment = Comment.objects.create(
+            post=post, author=self.alice, text='@bob, посмотри')
+        MentionedPost.objects.all().delete()
+        migration = import_module('posts.migrations.0022_mentioned_posts')
+        migration.fill_mentioned_posts(apps, None)
+        self.assert_mentioned_posts({('bob', post.pk, comment.created)})
+
+    def assert_mentioned_posts(self, expected):
+        self.assertEqual(
+            set(MentionedPost.objects.values_list(
+                'user__username', 'post', 'last_mentioned')),
+            expected,
+        )
+
+
+class PostTextHtmlTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(
+            text='Первый абзац <script>\nстрока\n\nВторой #абзац @author',
+            author=cls.author,
+        )
+        cls.comment = Comment.objects.create(
+            post=cls.post, author=cls.author, text='Ответ\nв две строки')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_html_rendered_on_save(self):
+        """HTML текста готовится при сохранении: абзацы, переносы, ссылки
+        и экранированная разметка из текста."""
+        tag_url = reverse('posts:tag_posts', args=['абзац'])
+        profile_url = reverse('posts:profile', args=['author'])
+        self.assertEqual(
+            self.post.text_html,
+            '<p>Первый абзац &lt;script&gt;<br>строка</p>\n\n'
+            f'<p>Второй <a href="{tag_url}">#абзац</a> '
+            f'<a href="{profile_url}">@author</a></p>',
+        )
+        self.assertEqual(
+            self.comment.text_html, '<p>Ответ<br>в две строки</p>')
+
+    def test_pages_do_not_process_text(self):
+        """Страницы выводят готовый HTML без разбора текста."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:post_detail', args=[self.post.pk]),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                with mock.patch(
+                    'django.template.defaultfilters.linebreaks_filter'
+                ) as linebreaks, mock.patch(
+                    'posts.markup.render_text'
+                ) as render_text:
+                    response = self.client.get(url)
+                linebreaks.assert_not_called()
+                render_text.assert_not_called()
+                self.assertContains(response, self.post.text_html)
+
+    def test_render_text_html_command(self):
+        """Команда заново готовит HTML и начала постов и HTML
+        комментариев."""
+        Post.objects.update(text_html='', excerpt_html='')
+        Comment.objects.update(text_html='')
+        call_command('render_text_html', chunk_size=1, stdout=StringIO())
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.text_html, self.post.text_html)
+        self.assertEqual(post.excerpt_html, self.post.excerpt_html)
+        self.assertEqual(
+            Comment.objects.get(pk=self.comment.pk).text_html,
+            self.comment.text_html,
+        )
+
+    @override_settings(ANONYMOUS_PAGE_CACHE=True)
+    def test_render_text_html_command_refreshes_caches(self):
+        """После команды карточки, ленты и страницы не отдают HTML,
+        закешированный до неё."""
+        Post.objects.update(
+            text_html='<p>Старый HTML</p>', excerpt_html='<p>Старый HTML</p>')
+        Comment.objects.update(text_html='<p>Старый комментарий</p>')
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', args=['author']),
+            reverse('posts:post_detail', args=[self.post.pk]),
+        )
+        for url in urls:
+            self.assertContains(self.client.get(url), 'Старый')
+        call_command('render_text_html', stdout=StringIO())
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertNotContains(response, 'Старый')
+                self.assertContains(response, 'Второй')
+
+
+@override_settings(POST_EXCERPT_LENGTH=20, POST_EXCERPT_PARAGRAPHS=2)
+class PostExcerptTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    def setUp(self):
+        cache.clear()
+
+    def create_post(self, text):
+        return Post.objects.create(text=text, author=self.author)
+
+    def test_excerpt(self):
+        """Начало поста — первые абзацы, обрезанные по границе слова."""
+        short = self.create_post('Короткий пост')
+        self.assertEqual(short.excerpt_html, '<p>Короткий пост</p>')
+        self.assertFalse(short.is_truncated)
+        paragraphs = self.create_post('Один\n\nДва\n\nТри')
+        self.assertEqual(
+            paragraphs.excerpt_html, '<p>Один</p>\n\n<p>Два</p>')
+        self.assertTrue(paragraphs.is_truncated)
+        long = self.create_post('Очень длинный текст #поста без абзацев')
+        self.assertEqual(long.excerpt_html, '<p>Очень длинный текст…</p>')
+        self.assertTrue(long.is_truncated)
+
+    def test_extra_blank_lines_do_not_truncate(self):
+        """Лишние пустые строки между абзацами не делают короткий текст
+        обрезанным."""
+        self.assertEqual(excerpt('a\n\n\nb'), ('a\n\nb', False))
+        self.assertEqual(excerpt('a\r\n\r\n\r\nb\n\n'), ('a\n\nb', False))
+        self.assertEqual(excerpt('a\n\n\n\nb\n\nc'), ('a\n\nb', True))
+        post = self.create_post('Один\n\n\n\nДва')
+        self.assertFalse(post.is_truncated)
+
+    def test_feed_shows_excerpt_with_link(self):
+        """Лента выводит начало поста со ссылкой на полный текст, а
+        страница поста — весь текст."""
+        post = self.create_post('Начало поста\n\nсередина\n\nконец поста')
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'Начало поста')
+        self.assertNotContains(response, 'конец поста')
+        self.assertContains(response, 'читать дальше')
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk]))
+        self.assertContains(response, 'конец поста')
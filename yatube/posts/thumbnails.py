@@ -0,0 +1,236 @@
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.dispatch import Signal
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE, KVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from .storage import post_image_storage
+
+logger = logging.getLogger(__name__)
+
+# Отправляется, когда для картинки готовы все миниатюры POST_THUMBNAILS.
+thumbnails_ready = Signal(providing_args=['name'])
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = contextvars.ContextVar('pending_thumbnails', default=None)
+_prefetched = contextvars.ContextVar('prefetched_thumbnails', default=None)
+
+
+class PostThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl-thumbnail для картинок постов: рендер только ищет
+    готовые миниатюры, а пул создаёт весь набор за одно декодирование."""
+
+    def get_existing(self, file_, geometry_string, **options):
+        return default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, options))
+
+    def thumbnail_file(self, file_, geometry_string, options):
+        # Опции дополняются так же, как в ThumbnailBackend.get_thumbnail,
+        # иначе имя файла миниатюры не совпадёт.
+        source = ImageFile(file_)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def create_many(self, file_, thumbnails):
+        """Создаёт недостающие миниатюры [(геометрия, опции)], открывая и
+        декодируя исходную картинку один раз. Возвращает False, если
+        исходник прочитать не удалось."""
+        source = ImageFile(file_)
+        missing = []
+        for geometry, options in thumbnails:
+            options = dict(options)
+            thumbnail = self.thumbnail_file(file_, geometry, options)
+            if not default.kvstore.get(thumbnail):
+                missing.append((geometry, options, thumbnail))
+        if not missing:
+            return True
+        # Файл миниатюры мог остаться без записи в хранилище: его только
+        # регистрируем, как и get_thumbnail, иначе storage.save даст ему
+        # другое имя.
+        absent = [item for item in missing if not item[2].exists()]
+        if absent:
+            try:
+                source_image = default.engine.get_image(source)
+            except Exception:
+                logger.exception('Не удалось открыть картинку %s', source.name)
+                return False
+            try:
+                image_info = default.engine.get_image_info(source_image)
+                source.set_size(default.engine.get_image_size(source_image))
+                for geometry, options, thumbnail in absent:
+                    options['image_info'] = image_info
+                    self._create_thumbnail(
+                        source_image, geometry, options, thumbnail)
+            finally:
+                default.engine.cleanup(source_image)
+        default.kvstore.get_or_set(source)
+        for geometry, options, thumbnail in missing:
+            default.kvstore.set(thumbnail, source)
+        return True
+
+
+backend = PostThumbnailBackend()
+
+
+class PrefetchingKVStore(KVStore):
+    """Хранилище sorl-thumbnail поверх кеша с базой как запасным слоем.
+
+    Внутри prefetch_thumbnails() записи о миниатюрах всех постов страницы
+    уже прочитаны одним get_many и отдаются без обращения к кешу и базе.
+    """
+
+    def _get_raw(self, key):
+        prefetched = _prefetched.get()
+        if prefetched is not None and key in prefetched:
+            value = prefetched[key]
+            return None if value == EMPTY_VALUE else value
+        return super()._get_raw(key)
+
+    def _set_raw(self, key, value):
+        self._forget(key)
+        super()._set_raw(key, value)
+
+    def _delete_raw(self, *keys):
+        for key in keys:
+            self._forget(key)
+        super()._delete_raw(*keys)
+
+    def _forget(self, key):
+        prefetched = _prefetched.get()
+        if prefetched is not None:
+            prefetched.pop(key, None)
+
+    def get_raw_many(self, keys):
+        """Значения по ключам: из кеша одним get_many, недостающие — из
+        базы одним запросом с дозаписью в кеш."""
+        found = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            stored = dict(KVStoreModel.objects.filter(
+                key__in=missing).values_list('key', 'value'))
+            fetched = {key: stored.get(key, EMPTY_VALUE) for key in missing}
+            self.cache.set_many(
+                fetched, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+            found.update(fetched)
+        return found
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.POST_THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+    return _executor
+
+
+def generate(name):
+    """Создаёт все миниатюры POST_THUMBNAILS для картинки name и
+    возвращает True, если все они готовы."""
+    return backend.create_many(
+        ImageFile(name, post_image_storage), settings.POST_THUMBNAILS)
+
+
+def _generate_in_background(name):
+    close_old_connections()
+    try:
+        if generate(name):
+            thumbnails_ready.send(sender=None, name=name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+    finally:
+        close_old_connections()
+
+
+def schedule(name):
+    """Ставит создание миниатюр картинки name в очередь пула потоков.
+
+    Повторная постановка той же картинки из любого процесса подавляется
+    на POST_THUMBNAIL_RETRY секунд. При POST_THUMBNAIL_WORKERS = 0
+    миниатюры создаются сразу в текущем потоке.
+    """
+    if not name:
+        return
+    if not settings.POST_THUMBNAIL_WORKERS:
+        generate(name)
+        return
+    if cache.add(f'thumbnails:{name}', True, settings.POST_THUMBNAIL_RETRY):
+        get_executor().submit(_generate_in_background, name)
+
+
+def ready_thumbnail(file_, geometry, **options):
+    """Готовая миниатюра или None; в последнем случае её создание
+    ставится в очередь, а текущий рендер отмечается как неполный."""
+    thumbnail = backend.get_existing(file_, geometry, **options)
+    if thumbnail is None:
+        schedule(str(file_))
+        if not settings.POST_THUMBNAIL_WORKERS:
+            thumbnail = backend.get_existing(file_, geometry, **options)
+    if thumbnail is None:
+        pending = _pending.get()
+        if pending is not None:
+            pending.append(str(file_))
+    return thumbnail
+
+
+def delete_thumbnails(name, storage):
+    """Удаляет миниатюры картинки name и записи о них."""
+    default.kvstore.delete(ImageFile(name, storage))
+
+
+@contextmanager
+def prefetch_thumbnails(posts):
+    """Заранее читает записи о миниатюрах POST_THUMBNAILS для картинок
+    постов, чтобы теги {% thumbnail %} внутри блока не ходили в хранилище
+    по одной."""
+    keys = [
+        add_prefix(
+            backend.thumbnail_file(post.image, geometry, dict(options)).key)
+        for post in posts if post.image and post.image_format
+        for geometry, options in settings.POST_THUMBNAILS
+    ]
+    kvstore = default.kvstore
+    if not keys or not hasattr(kvstore, 'get_raw_many'):
+        yield
+        return
+    token = _prefetched.set(kvstore.get_raw_many(keys))
+    try:
+        yield
+    finally:
+        _prefetched.reset(token)
+
+
+@contextmanager
+def collect_pending():
+    """Собирает картинки, миниатюры которых не были готовы при рендере:
+    такой фрагмент не стоит класть в долгий кеш."""
+    pending = []
+    token = _pending.set(pending)
+    try:
+        yield pending
+    finally:
+        _pending.reset(token)
@@ -1,9 +1,189 @@
+import base64
+import binascii
+from collections.abc import Sequence
+
 from django.core.paginator import Paginator
 from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
 
+def paginator(request, post_list, cursor=None, count=None):
+    """Страница ленты постов.
 
-def paginator(request, post_list):
+    По умолчанию используется обычная постраничная навигация ``?page=N``.
+    При ``cursor=True`` (или ``settings.POSTS_CURSOR_PAGINATION``) лента
+    листается курсорами ``?after=``/``?before=`` без COUNT и OFFSET.
+    Заранее известное число постов ``count`` избавляет от COUNT-запроса.
+    Ленты со своим ключом порядка задают свой курсорный пагинатор в
+    атрибуте ``cursor_paginator``.
+    """
+    if cursor is None:
+        cursor = settings.POSTS_CURSOR_PAGINATION
+    if cursor:
+        paginator_class = getattr(
+            post_list, 'cursor_paginator', CursorPaginator)
+        return paginator_class(post_list, settings.POSTS_PER_PAGE).get_page(
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+        )
     paginator = Paginator(post_list, settings.POSTS_PER_PAGE)
+    if count is not None:
+        paginator.count = count
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     return page_obj
+
+
+def encode_key(*parts):
+    """Непрозрачный токен позиции из частей ключа, например
+    (pub_date, id)."""
+    raw = '|'.join(str(part) for part in parts).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_key(token, *converters):
+    """Части ключа из токена encode_key, приведённые функциями
+    converters; None, если токен битый."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        parts = raw.decode().split('|')
+        if len(parts) != len(converters):
+            return None
+        return tuple(
+            convert(part) for convert, part in zip(converters, parts))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def parse_key_datetime(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        raise ValueError(value)
+    return moment
+
+
+def encode_cursor(post):
+    """Непрозрачный токен позиции поста в ленте: (pub_date, id)."""
+    return encode_key(post.pub_date.isoformat(), post.pk)
+
+
+def decode_cursor(token):
+    """Возвращает (pub_date, id) из токена или None, если токен битый."""
+    return decode_key(token, parse_key_datetime, int)
+
+
+def seek(posts, key, newer, limit, fields=('pub_date', 'pk')):
+    """Не более limit записей строго новее (newer=True) или строго старше
+    ключа (pub_date, id); без ключа — самые свежие записи.
+
+    fields — имена полей ключа в запросе. Новые записи возвращаются по
+    возрастанию ключа, старые — по убыванию.
+    """
+    date_field, pk_field = fields
+    if key is not None:
+        pub_date, pk = key
+        lookup = 'gt' if newer else 'lt'
+        posts = posts.filter(
+            Q(**{f'{date_field}__{lookup}': pub_date})
+            | Q(**{date_field: pub_date, f'{pk_field}__{lookup}': pk})
+        )
+    if newer:
+        posts = posts.order_by(date_field, pk_field)
+    else:
+        posts = posts.order_by(f'-{date_field}', f'-{pk_field}')
+    return list(posts[:limit])
+
+
+class CursorPaginator:
+    """Курсорная (keyset) навигация по ленте, упорядоченной по
+    (-pub_date, -id).
+
+    Каждая страница — один запрос с условием по ключу и LIMIT, поэтому
+    время её получения не зависит от глубины и COUNT не нужен.
+    """
+    is_cursor = True
+    # Кодирование ключа позиции в токен и обратно; подклассы с другим
+    # порядком записей подставляют свои.
+    encode_cursor = staticmethod(encode_cursor)
+    decode_cursor = staticmethod(decode_cursor)
+
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+
+    def _seek(self, key, newer):
+        # Составные ленты (например, HybridFeed) умеют листать себя сами.
+        seek_list = getattr(self.object_list, 'seek', None)
+        if seek_list is not None:
+            return seek_list(key, newer, self.per_page + 1)
+        return seek(self.object_list, key, newer, self.per_page + 1)
+
+    def get_page(self, after=None, before=None):
+        before_key = self.decode_cursor(before)
+        if before_key is not None:
+            posts = self._seek(before_key, newer=True)
+            if posts:
+                has_previous = len(posts) > self.per_page
+                posts = posts[:self.per_page][::-1]
+                return CursorPage(self, posts, before, has_previous, True)
+        after_key = self.decode_cursor(after)
+        posts = self._seek(after_key, newer=False)
+        has_next = len(posts) > self.per_page
+        return CursorPage(
+            self,
+            posts[:self.per_page],
+            after if after_key is not None else '',
+            after_key is not None,
+            has_next,
+        )
+
+
+class CursorPage(Sequence):
+    """Страница курсорной ленты с интерфейсом, совместимым с Page в
+    шаблонах: итерация, len(), индексация и has_next/has_previous.
+    """
+    is_cursor = True
+
+    def __init__(self, paginator, object_list, number, has_previous,
+                 has_next):
+        self.paginator = paginator
+        self.object_list = object_list
+        # Токен, которым запрошена страница; используется как часть ключа
+        # кеша вместо номера страницы.
+        self.number = number
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return f'<CursorPage {self.number or "first"}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    @property
+    def next_cursor(self):
+        if self.has_next():
+            return self.paginator.encode_cursor(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        # Пустой токен у страницы за концом ленты ведёт на первую страницу.
+        if self.has_previous() and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0])
+        return ''
@@ -1,48 +1,82 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.http import Http404
+from django.utils.http import urlencode
+from django.views.decorators.http import require_safe
 
-from .models import Post, Group, User, Follow
+from core.views import serve_media
+
+from .models import Comment, Post, Group, Tag, User, Follow
 from .forms import PostForm, CommentForm
 from .utils import paginator
+from .search import SearchPaginator, SearchResults
+from .feeds import HybridFeed, MentionFeed, TagFeed, deferred_text
+from .caching import feed_version
+from .counters import user_counter
+from .thumbnails import schedule as schedule_thumbnails
+from . import resize
+from .tags import normalize, trending_tags
 
 
 def index(request):
-    post_list = Post.objects.select_related('author', 'group').all()
+    post_list = Post.objects.select_related('author', 'group').defer(
+        *deferred_text())
     page_obj = paginator(request, post_list)
     context = {
         'page_obj': page_obj,
         'index': True,
+        'feed_version': feed_version('index'),
     }
     return render(request, 'posts/index.html', context)
 
 
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.select_related('author').all()
+    post_list = group.posts.select_related('author').defer(
+        *deferred_text())
     page_obj = paginator(request, post_list)
     context = {
         'group': group,
         'page_obj': page_obj,
+        'feed_version': feed_version('group', group.pk),
     }
     return render(request, 'posts/group_list.html', context)
 
 
+def tag_posts(request, name):
+    tag = get_object_or_404(Tag, name=normalize(name))
+    page_obj = paginator(request, TagFeed(tag))
+    context = {
+        'tag': tag,
+        'page_obj': page_obj,
+        'trending_tags': trending_tags(),
+    }
+    return render(request, 'posts/tag_list.html', context)
+
+
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(
+        User.objects.select_related('counter'), username=username)
     following = request.user.is_authenticated and Follow.objects.filter(
         user=request.user, author=author).exists()
-    post_list = author.posts.select_related('group').all()
-    page_obj = paginator(request, post_list)
+    post_list = author.posts.select_related('group').defer(
+        *deferred_text())
+    page_obj = paginator(
+        request, post_list, count=user_counter(author).posts_count)
     context = {
         'author': author,
         'page_obj': page_obj,
         'following': following,
+        'feed_version': feed_version('author', author.pk),
     }
     return render(request, 'posts/profile.html', context)
 
 
 def post_detail(request, post_id):
-    post = get_object_or_404(Post.objects.select_related('author'), id=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__counter', 'group'), id=post_id)
+    user_counter(post.author)
     form = CommentForm()
     comments = post.comments.all()
     context = {
@@ -53,6 +87,31 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    # ?in=comments ищет по комментариям, иначе — по постам.
+    scope = 'comments' if request.GET.get('in') == 'comments' else ''
+    queryset = None
+    if scope:
+        queryset = Comment.objects.select_related('author')
+    page_obj = SearchPaginator(
+        SearchResults(query, queryset), settings.POSTS_PER_PAGE
+    ).get_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+    params = {'q': query, 'in': scope}
+    context = {
+        'query': query,
+        'scope': scope,
+        'page_obj': page_obj,
+        # Параметры запроса, которые сохраняют ссылки на соседние страницы.
+        'page_params': urlencode(
+            {name: value for name, value in params.items() if value}),
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def post_create(request):
     form = PostForm(
@@ -63,6 +122,7 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        schedule_thumbnails(post.image.name)
         return redirect('posts:profile', username=post.author)
     return render(request, 'posts/create_post.html', {'form': form})
 
@@ -78,7 +138,9 @@ def post_edit(request, post_id):
         instance=post
     )
     if form.is_valid():
-        form.save()
+        post = form.save()
+        if 'image' in form.changed_data:
+            schedule_thumbnails(post.image.name)
         return redirect('posts:post_detail', post_id=post_id)
     context = {
         'form': form,
@@ -101,7 +163,7 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
+    post_list = HybridFeed(request.user)
     page_obj = paginator(request, post_list)
     context = {
         'page_obj': page_obj,
@@ -110,6 +172,15 @@ def follow_index(request):
     return render(request, 'posts/follow.html', context)
 
 
+@login_required
+def mention_index(request):
+    page_obj = paginator(request, MentionFeed(request.user))
+    context = {
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/mentions.html', context)
+
+
 @login_required
 def profile_follow(request, username):
     follow = get_object_or_404(User, username=username)
@@ -126,3 +197,20 @@ def profile_unfollow(request, username):
     follow = get_object_or_404(User, username=username)
     Follow.objects.filter(user=request.user, author=follow).delete()
     return redirect('posts:profile', username=username)
+
+
+@require_safe
+def resize_image(request, signature, geometry, name):
+    """Вариант картинки поста нужного размера по подписанному адресу
+    (см. тег resized_url). Вариант создаётся при первом запросе и
+    отдаётся с диска как медиафайл."""
+    try:
+        width, height, crop = resize.parse_geometry(geometry)
+    except ValueError:
+        raise Http404
+    if not resize.check_signature(name, geometry, signature):
+        raise Http404
+    relative = resize.resized(name, width, height, crop)
+    if relative is None:
+        raise Http404
+    return serve_media(request, relative)
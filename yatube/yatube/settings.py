@@ -10,7 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -25,6 +29,8 @@ SECRET_KEY = 'ce7%9*wz&*6agjbp&@hz+ll(0o#=30%t3ubc=d4cm!l5=u=!6&'
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 THUMBNAIL_DEBUG = True
+# Записи о миниатюрах читаются из кеша пачкой на страницу ленты
+THUMBNAIL_KVSTORE = 'posts.thumbnails.PrefetchingKVStore'
 
 ALLOWED_HOSTS = [
     'localhost',
@@ -52,6 +58,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'posts.middleware.AnonymousPageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -147,6 +154,80 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 POSTS_PER_PAGE: int = 10
 POSTS_COUNT_FOR_PAGINATOR: int = 12
+# Курсорная навигация ?after=/?before= вместо ?page=N (без COUNT и OFFSET)
+POSTS_CURSOR_PAGINATION: bool = False
+# Начало поста в лентах: не больше POST_EXCERPT_PARAGRAPHS абзацев и
+# POST_EXCERPT_LENGTH символов, полный текст — на странице поста
+POST_EXCERPT_LENGTH: int = 500
+POST_EXCERPT_PARAGRAPHS: int = 3
+# Сколько хештегов поста попадает в ленты тегов
+POST_MAX_TAGS: int = 10
+# Сколько упомянутых в посте или комментарии пользователей получают
+# ссылку и запись в ленте упоминаний
+POST_MAX_MENTIONS: int = 20
+# Популярные теги: самые частые за TAG_TRENDING_HOURS часов, список
+# пересчитывается раз в TAG_TRENDING_CACHE_TIMEOUT секунд
+TAG_TRENDING_HOURS: int = 24
+TAG_TRENDING_COUNT: int = 10
+TAG_TRENDING_CACHE_TIMEOUT: int = 60 * 5
+# Сколько первых слов поискового запроса учитывается
+SEARCH_MAX_WORDS: int = 10
+# Сколько последних постов хранится в материализованной ленте подписок
+FOLLOW_TIMELINE_LENGTH: int = 1000
+FOLLOW_TIMELINE_BATCH_SIZE: int = 500
+# Посты авторов с таким числом подписчиков не раскладываются по лентам,
+# а подмешиваются в ленту подписок при чтении
+FEED_CELEBRITY_FOLLOWERS: int = 10000
+FEED_CELEBRITY_CACHE_TIMEOUT: int = 300
+# Отрендеренные карточки постов; ключ меняется при изменении поста
+POST_CARD_CACHE_TIMEOUT: int = 60 * 60 * 24
+# Кеш целых страниц для анонимных посетителей; в режиме отладки выключен,
+# чтобы тесты и разработчик видели контекст шаблонов
+ANONYMOUS_PAGE_CACHE: bool = not DEBUG
+ANONYMOUS_PAGE_CACHE_TIMEOUT: int = 60 * 10
+ANONYMOUS_PAGE_CACHE_VIEWS = (
+    'posts:index',
+    'posts:group_list',
+    'posts:profile',
+    'posts:post_detail',
+)
+# Защита от одновременного пересчёта кеша: блокировка на пересчёт, сколько
+# ждать чужого пересчёта, сколько хранить прежнее значение и коэффициент
+# вероятностного раннего истечения
+CACHE_LOCK_TIMEOUT: int = 30
+CACHE_LOCK_WAIT: float = 2
+CACHE_STALE_TIMEOUT: int = 60 * 60
+CACHE_EARLY_EXPIRY_BETA: float = 1.0
+# Набор миниатюр картинок постов для srcset; создаётся пулом потоков
+# после загрузки картинки
+POST_THUMBNAILS = (
+    ('320x113', {'crop': 'center', 'upscale': True}),
+    ('640x226', {'crop': 'center', 'upscale': True}),
+    ('960x339', {'crop': 'center', 'upscale': True}),
+    ('1920x678', {'crop': 'center', 'upscale': True}),
+)
+# Миниатюра для src и размеров width/height, остальные идут в srcset
+POST_THUMBNAIL_DEFAULT = '960x339'
+POST_IMAGE_SIZES = '(max-width: 960px) 100vw, 960px'
+# Потоков создания миниатюр; при 0 (режим отладки) миниатюры создаются
+# сразу при рендере
+POST_THUMBNAIL_WORKERS: int = 0 if DEBUG else 2
+# Не чаще скольких секунд повторять создание миниатюр одной картинки
+POST_THUMBNAIL_RETRY: int = 60 * 5
+# Загрузки до любой обработки проверяются по заголовку: объём файла,
+# формат, наибольшая сторона и число пикселей
+POST_IMAGE_MAX_UPLOAD_SIZE: int = 20 * 1024 * 1024
+POST_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP', 'TIFF', 'BMP')
+POST_IMAGE_MAX_DIMENSION: int = 12000
+POST_IMAGE_MAX_PIXELS: int = 40 * 1000 * 1000
+# Загруженные картинки уменьшаются до этих размеров и перекодируются
+# без метаданных; рядом кладётся WebP-вариант
+POST_IMAGE_MAX_SIZE = (2048, 2048)
+POST_IMAGE_QUALITY: int = 85
+POST_IMAGE_WEBP_QUALITY: int = 80
+# Файлы картинок общие для одинаковых загрузок; файл без ссылок удаляется,
+# только если его не сохраняли повторно столько секунд
+POST_IMAGE_RELEASE_GRACE: int = 60 * 10
 FIRST_SYMBOLS: int = 15
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
@@ -156,9 +237,53 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Кто отдаёт байты медиафайлов: None — сам Django (разработка),
+# 'x-accel-redirect' — nginx через internal-локацию MEDIA_ACCEL_PREFIX,
+# 'x-sendfile' — Apache или lighttpd
+MEDIA_SENDFILE = None if DEBUG else 'x-accel-redirect'
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Миниатюры sorl и картинки с именем по хешу содержимого не меняются и
+# кешируются браузером на год, остальные файлы — на час
+MEDIA_IMMUTABLE_PATTERNS = (
+    r'^cache/',
+    r'^resized/',
+    r'^posts/[0-9a-f]{2}/[0-9a-f]{64}\.',
+)
+MEDIA_IMMUTABLE_MAX_AGE: int = 60 * 60 * 24 * 365
+MEDIA_MAX_AGE: int = 60 * 60
+# Варианты картинок постов по подписанным адресам (posts.resize) лежат
+# в MEDIA_ROOT/RESIZE_CACHE_DIR; сторона не больше RESIZE_MAX_DIMENSION
+RESIZE_CACHE_DIR = 'resized'
+RESIZE_MAX_DIMENSION: int = 2048
+# Объём кеша вариантов: команда cull_resized_images удаляет давно не
+# читавшиеся файлы, пока кеш больше RESIZE_CACHE_MAX_SIZE байт
+RESIZE_CACHE_MAX_SIZE: int = 1024 * 1024 * 1024
+# Время чтения варианта обновляется не чаще раза в столько секунд
+RESIZE_CACHE_TOUCH_INTERVAL: int = 60 * 60
+# Загрузки пишутся во временный файл по частям, а не собираются в памяти
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
 
+# Общий для всех воркеров хоста кеш в файле SQLite (WAL) с вытеснением LRU
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'default.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_SIZE': 512 * 1024 * 1024,
+            # Время чтения для LRU обновляется не чаще раза в минуту, чтобы
+            # чтение не становилось записью
+            'TOUCH_INTERVAL': 60,
+        },
     }
 }
+# Тесты (manage.py test и pytest) не читают и не очищают общий файл кеша:
+# у каждого запуска свой файл во временном каталоге, удаляемый при выходе
+TESTING: bool = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+if TESTING:
+    TEST_CACHE_DIR = tempfile.mkdtemp(prefix='yatube-cache-')
+    atexit.register(shutil.rmtree, TEST_CACHE_DIR, ignore_errors=True)
+    CACHES['default']['LOCATION'] = os.path.join(
+        TEST_CACHE_DIR, 'default.sqlite3')